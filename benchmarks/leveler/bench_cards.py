@@ -0,0 +1,424 @@
+"""Offline benchmark for Leveler card renderers.
+
+Renders profile, rank and levelup cards from the images in ./fixtures with
+fake users and guilds, stubbed HTTP and an in-memory users collection, so
+neither Discord, MongoDB nor network access is needed. Red and the cog
+requirements still have to be installed.
+
+Every case runs in its own process, so peak RSS is reported per case.
+
+    python benchmarks/leveler/bench_cards.py
+    python benchmarks/leveler/bench_cards.py --rounds 100 --save before.json
+    python benchmarks/leveler/bench_cards.py --save after.json --compare before.json
+
+Modes:
+    cold    both card caches are cleared before every render
+    static  cached static layers are kept, only dynamic values are drawn
+"""
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+FIXTURE_URL = "https://fixtures.invalid/"
+
+CASES = [
+    ("profile", 0),
+    ("profile", 3),
+    ("profile", 9),
+    ("rank", 0),
+    ("levelup", 0),
+]
+MODES = ("cold", "static")
+PERCENTILES = (50, 95, 99)
+
+
+class FakeContent:
+    def __init__(self, data):
+        self._data = data
+
+    async def read(self, n=-1):
+        return self._data
+
+    async def iter_chunked(self, n):
+        for i in range(0, len(self._data), n):
+            yield self._data[i : i + n]
+
+
+class FakeResponse:
+    def __init__(self, data, status=200):
+        self.status = status
+        self.content_length = len(data)
+        self.headers = {"Content-Length": str(len(data))}
+        self.content = FakeContent(data)
+
+    async def read(self):
+        return await self.content.read()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FixtureSession:
+    """Serves fixture files for FIXTURE_URL, 404 for anything else."""
+
+    def __init__(self):
+        self.requests = 0
+
+    def _request(self, url, **kwargs):
+        self.requests += 1
+        url = str(url)
+        path = FIXTURES / url[len(FIXTURE_URL) :]
+        if not url.startswith(FIXTURE_URL) or not path.is_file():
+            return FakeResponse(b"", status=404)
+        return FakeResponse(path.read_bytes())
+
+    get = head = _request
+
+    async def close(self):
+        pass
+
+    def detach(self):
+        pass
+
+
+class MemoryConfig:
+    """Registered defaults of redbot.core.Config, without any storage."""
+
+    @classmethod
+    def get_conf(cls, cog, identifier, force_registration=False):
+        return cls()
+
+    def __init__(self):
+        self._global = MemoryGroup({})
+        self._guild = MemoryGroup({})
+
+    def register_global(self, **defaults):
+        self._global.values.update(defaults)
+
+    def register_guild(self, **defaults):
+        self._guild.values.update(defaults)
+
+    def guild(self, guild):
+        return self._guild
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._global, name)
+
+
+class MemoryGroup:
+    def __init__(self, values):
+        self.values = values
+
+    def __getattr__(self, name):
+        if name == "values":
+            raise AttributeError(name)
+        return MemoryValue(self.values, name)
+
+    async def all(self):
+        return dict(self.values)
+
+
+class MemoryValue:
+    def __init__(self, values, name):
+        self.values = values
+        self.name = name
+
+    async def __call__(self):
+        return self.values[self.name]
+
+    async def set(self, value):
+        self.values[self.name] = value
+
+
+class MemoryCollection:
+    """The part of pymongo collection API used by renderers."""
+
+    def __init__(self, docs):
+        self.docs = {doc["user_id"]: doc for doc in docs}
+
+    def find_one(self, query):
+        return self.docs.get(query.get("user_id"))
+
+    def find(self, query=None):
+        return iter(list(self.docs.values()))
+
+
+class FakeGuild:
+    def __init__(self, id):
+        self.id = id
+        self.name = f"Guild {id}"
+
+
+class FakeUser:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.display_name = name
+        self.bot = False
+        self.avatar = f"avatar{id}"
+        self.avatar_url = f"{FIXTURE_URL}avatar.png"
+
+
+def make_users(guild, target, badges, population):
+    """Target user document plus `population` others for rank lookups."""
+    rng = random.Random(0)
+    docs = []
+    for user_id in range(target.id + 1, target.id + 1 + population):
+        docs.append(
+            {
+                "user_id": str(user_id),
+                "username": f"user{user_id}",
+                "total_exp": rng.randrange(100000),
+                "servers": {
+                    str(guild.id): {
+                        "level": rng.randrange(40),
+                        "current_exp": rng.randrange(500),
+                    }
+                },
+            }
+        )
+    badge_files = sorted(p.name for p in FIXTURES.glob("badge*.png"))
+    docs.append(
+        {
+            "user_id": str(target.id),
+            "username": target.name,
+            "servers": {str(guild.id): {"level": 27, "current_exp": 340}},
+            "total_exp": 51234,
+            "profile_background": f"{FIXTURE_URL}profile_background.jpg",
+            "rank_background": f"{FIXTURE_URL}rank_background.jpg",
+            "levelup_background": f"{FIXTURE_URL}levelup_background.jpg",
+            "title": "Benchmark Runner",
+            "info": "I render the same cards over and over again, "
+            "so that everybody knows how long it takes.",
+            "rep": 42,
+            "badges": {
+                f"badge{i}_bench": {
+                    "badge_name": f"badge{i}",
+                    "bg_img": FIXTURE_URL + badge_files[i % len(badge_files)],
+                    "border_color": "#FFFFFF" if i % 2 else None,
+                    "description": "Benchmark badge",
+                    "price": 0,
+                    "priority_num": badges - i,
+                }
+                for i in range(badges)
+            },
+            "active_badges": {},
+            "rep_color": [],
+            "badge_col_color": [],
+            "rep_block": 0,
+            "chat_block": 0,
+            "last_message": "",
+            "profile_block": 0,
+            "rank_block": 0,
+        }
+    )
+    return docs
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted `values`."""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def peak_rss_kib():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+async def run_case(card, badges, mode, rounds, warmup, population):
+    sys.path.insert(0, str(ROOT))
+    from leveler import leveler as lv
+
+    lv.Config = MemoryConfig
+    bot = SimpleNamespace(loop=asyncio.get_event_loop())
+    cog = lv.Leveler(bot)
+    await cog.session.close()
+    cog.session = cog._local_renderer.session = FixtureSession()
+
+    guild = FakeGuild(1)
+    user = FakeUser(1000, "Benchmark")
+    lv.db = SimpleNamespace(
+        users=MemoryCollection(make_users(guild, user, badges, population))
+    )
+    lv.bank = SimpleNamespace(
+        get_balance=lambda member: asyncio.sleep(0, result=1234),
+        get_currency_name=lambda guild=None: asyncio.sleep(0, result="credits"),
+    )
+
+    draw = getattr(cog, f"draw_{card}")
+    timings = []
+    for i in range(warmup + rounds):
+        cog._card_cache.clear()
+        if mode == "cold":
+            cog._layer_cache.clear()
+        start = time.perf_counter()
+        data = await draw(user, guild)
+        elapsed = (time.perf_counter() - start) * 1000
+        if i >= warmup:
+            timings.append(elapsed)
+    timings.sort()
+
+    result = {"card": card, "badges": badges, "mode": mode, "rounds": rounds}
+    for p in PERCENTILES:
+        result[f"p{p}_ms"] = round(percentile(timings, p), 3)
+    result["mean_ms"] = round(sum(timings) / len(timings), 3)
+    result["peak_rss_kib"] = peak_rss_kib()
+    result["bytes"] = len(data)
+    return result
+
+
+def run_in_subprocess(case, args):
+    card, badges, mode = case
+    proc = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--case",
+            f"{card}:{badges}:{mode}",
+            "--rounds",
+            str(args.rounds),
+            "--warmup",
+            str(args.warmup),
+            "--users",
+            str(args.users),
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if proc.returncode:
+        sys.exit(f"{card}:{badges}:{mode} failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=str(ROOT),
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_results(results):
+    header = (
+        f"{'card':<8} {'badges':>6} {'mode':<6} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'p99 ms':>9} {'peak RSS':>10} {'bytes':>8}"
+    )
+    lines = [header, "-" * len(header)]
+    for r in results:
+        rss = f"{r['peak_rss_kib'] / 1024:.1f} MiB" if r["peak_rss_kib"] else "n/a"
+        lines.append(
+            f"{r['card']:<8} {r['badges']:>6} {r['mode']:<6} {r['p50_ms']:>9.2f} "
+            f"{r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {rss:>10} {r['bytes']:>8}"
+        )
+    return "\n".join(lines)
+
+
+def format_comparison(old, new):
+    """Relative change of every metric between two saved runs."""
+    metrics = ["p50_ms", "p95_ms", "p99_ms", "peak_rss_kib", "bytes"]
+    previous = {(r["card"], r["badges"], r["mode"]): r for r in old["results"]}
+    header = f"{'card':<8} {'badges':>6} {'mode':<6} " + " ".join(
+        f"{m:>13}" for m in metrics
+    )
+    lines = [
+        f"{old['meta'].get('revision')} -> {new['meta'].get('revision')}",
+        header,
+        "-" * len(header),
+    ]
+    for r in new["results"]:
+        before = previous.get((r["card"], r["badges"], r["mode"]))
+        if before is None:
+            continue
+        changes = []
+        for m in metrics:
+            if not before[m] or r[m] is None:
+                changes.append(f"{'n/a':>13}")
+            else:
+                changes.append(f"{(r[m] - before[m]) / before[m]:>+13.1%}")
+        lines.append(
+            f"{r['card']:<8} {r['badges']:>6} {r['mode']:<6} " + " ".join(changes)
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Leveler card rendering.")
+    parser.add_argument(
+        "--rounds", type=int, default=30, help="measured renders per case"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=3, help="unmeasured renders per case"
+    )
+    parser.add_argument("--users", type=int, default=500, help="users in fake database")
+    parser.add_argument("--mode", choices=MODES + ("all",), default="all")
+    parser.add_argument("--card", choices=sorted({c for c, _ in CASES}), default=None)
+    parser.add_argument("--save", type=Path, help="write results as JSON to this file")
+    parser.add_argument("--compare", type=Path, help="JSON results of previous run")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        card, badges, mode = args.case.split(":")
+        result = asyncio.get_event_loop().run_until_complete(
+            run_case(card, int(badges), mode, args.rounds, args.warmup, args.users)
+        )
+        print(json.dumps(result))
+        return
+
+    modes = MODES if args.mode == "all" else (args.mode,)
+    results = []
+    for card, badges in CASES:
+        if args.card and card != args.card:
+            continue
+        for mode in modes:
+            results.append(run_in_subprocess((card, badges, mode), args))
+    print(format_results(results))
+
+    run = {
+        "meta": {
+            "revision": git_revision(),
+            "date": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rounds": args.rounds,
+            "users": args.users,
+        },
+        "results": results,
+    }
+    if args.save:
+        args.save.write_text(json.dumps(run, indent=2))
+    if args.compare:
+        print()
+        print(format_comparison(json.loads(args.compare.read_text()), run))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""Load generator for the Leveler message pipeline.
+
+Replays a synthetic stream of guild messages through
+Leveler._handle_on_message, with fake guilds, members and channels, and
+mongomock (or a local mongod with --mongo) as database. Level-up cards are
+not rendered, level-up roles, badges and message credits are given, exp
+ledger is written with --ledger.
+
+Messages are spread over simulated chat time (--chat-rate messages per
+simulated second), so exp cooldowns expire like they would on real
+servers, while the stream itself is replayed as fast as possible (or at
+--rate messages per second). Red and the cog requirements still have to
+be installed, plus mongomock unless --mongo is given.
+
+    python benchmarks/leveler/bench_messages.py
+    python benchmarks/leveler/bench_messages.py --guilds 50 --users 5000 --messages 100000
+    python benchmarks/leveler/bench_messages.py --mongo mongodb://localhost:27017
+
+Reported:
+    msg/s       messages replayed per second, until every queued event is processed
+    db ops      database calls per message, by method
+    level-ups   per second, with role edits and badges given
+    loop lag    how late a 10 ms timer fires while messages are processed
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+
+from bench_cards import ROOT, MemoryConfig, git_revision, percentile
+
+WORDS = (
+    "the of and to in is you that it he was for on are as with his they at be "
+    "this have from or one had by word but not what all were we when your can "
+    "said there use an each which she do how their if will up other about out"
+).split()
+LAG_INTERVAL = 0.01  # seconds
+
+
+class CountedCollection:
+    """Counts calls to collection methods in shared `ops`."""
+
+    def __init__(self, collection, ops):
+        self._collection = collection
+        self._ops = ops
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+        ops = self._ops
+
+        def counted(*args, **kwargs):
+            ops[name] += 1
+            return method(*args, **kwargs)
+
+        return counted
+
+
+class SimClock:
+    """time.time() replacement, advanced by replayed messages."""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+
+class FakeRole:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class FakeChannel:
+    def __init__(self, id, guild):
+        self.id = id
+        self.guild = guild
+        self.sent = 0
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+
+
+class FakeGuild:
+    def __init__(self, id, roles):
+        self.id = id
+        self.name = f"Guild {id}"
+        self.roles = [FakeRole(id, "@everyone")] + roles
+        self._roles = {role.id: role for role in self.roles}
+        self.channels = []
+
+    def get_role(self, role_id):
+        return self._roles.get(role_id)
+
+
+class FakeMember:
+    edits = 0
+
+    def __init__(self, id, guild):
+        self.id = id
+        self.guild = guild
+        self.name = f"user{id}"
+        self.display_name = self.name
+        self.mention = f"<@{id}>"
+        self.bot = False
+        self.roles = guild.roles[:1]
+
+    async def edit(self, roles, reason=None):
+        FakeMember.edits += 1
+        self.roles = self.guild.roles[:1] + list(roles)
+
+
+class FakeBank:
+    def __init__(self):
+        self.deposits = 0
+
+    async def is_global(self):
+        return False
+
+    async def deposit_credits(self, member, amount):
+        self.deposits += 1
+
+
+def make_database(args):
+    if args.mongo:
+        from pymongo import MongoClient
+
+        client = MongoClient(args.mongo)
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock is not installed, install it or use --mongo")
+        client = mongomock.MongoClient()
+    client.drop_database("leveler_bench")
+    return client["leveler_bench"]
+
+
+def make_guilds(args, database):
+    """Guilds with their channels, members and level links."""
+    rng = random.Random(0)
+    guilds = []
+    for g in range(args.guilds):
+        guild_id = 10**6 * (g + 1)
+        # every level up to --linked-levels gives a role and removes previous one
+        roles = [
+            FakeRole(guild_id + level, f"Level {level}")
+            for level in range(1, args.linked_levels + 1)
+        ]
+        guild = FakeGuild(guild_id, roles)
+        guild.channels = [
+            FakeChannel(guild_id + 1000 + c, guild) for c in range(args.channels)
+        ]
+        database.roles.insert_one(
+            {
+                "server_id": str(guild_id),
+                "roles": {
+                    role.name: {
+                        "level": str(level),
+                        "remove_role": f"Level {level - 1}" if level > 1 else None,
+                    }
+                    for level, role in enumerate(roles, 1)
+                },
+            }
+        )
+        if args.linked_levels:
+            badge = {"badge_name": "chatty", "bg_img": "", "price": -1}
+            database.badges.insert_one(
+                {"server_id": str(guild_id), "badges": {"chatty": badge}}
+            )
+            database.badgelinks.insert_one(
+                {
+                    "server_id": str(guild_id),
+                    "badges": {"chatty": str(args.linked_levels)},
+                }
+            )
+        guilds.append(guild)
+    # members are spread between guilds, some are in several of them
+    members = []
+    for user_id in range(1, args.users + 1):
+        for guild in rng.sample(guilds, min(len(guilds), 1 + rng.randrange(2))):
+            members.append(FakeMember(user_id, guild))
+    return guilds, members
+
+
+def make_messages(args, members):
+    """Messages with a mix of chat, short replies, commands and repeats."""
+    rng = random.Random(1)
+    messages = []
+    last = {}
+    for _ in range(args.messages):
+        member = rng.choice(members)
+        kind = rng.random()
+        if kind < 0.2:
+            content = rng.choice(("ok", "lol", "yes", "no", "+1"))
+        elif kind < 0.25:
+            content = rng.choice(("!rank", "!profile", "!top", "!help levels"))
+        elif kind < 0.3 and member.id in last:
+            content = last[member.id]
+        else:
+            content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 15)))
+        last[member.id] = content
+        messages.append(
+            SimpleNamespace(
+                content=content,
+                author=member,
+                guild=member.guild,
+                channel=rng.choice(member.guild.channels),
+                attachments=[],
+            )
+        )
+    return messages
+
+
+async def measure_lag(lags):
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(loop.time() - start - LAG_INTERVAL)
+
+
+async def run(args):
+    sys.path.insert(0, str(ROOT))
+    from leveler import credits, eligibility, leveler as lv
+
+    ops = Counter()
+    database = make_database(args)
+    guilds, members = make_guilds(args, database)
+    messages = make_messages(args, members)
+
+    clock = SimClock()
+    lv.time = eligibility.time = clock
+    lv.Config = MemoryConfig
+    lv.db = SimpleNamespace(
+        **{
+            name: CountedCollection(database[name], ops)
+            for name in (
+                "users",
+                "roles",
+                "badges",
+                "badgelinks",
+                "exp_ledger",
+                "exp_totals",
+                "exp_ledger_state",
+            )
+        }
+    )
+    lv.bank = credits.bank = fake_bank = FakeBank()
+    loop = asyncio.get_event_loop()
+    bot = SimpleNamespace(
+        loop=loop,
+        command_prefix=lambda bot, message: asyncio.sleep(0, result=["!"]),
+        dispatch=lambda *args: None,
+    )
+    cog = lv.Leveler(bot)
+    await cog.session.close()
+    await cog.config.guild(None).msg_credits.set(args.credits)
+    await cog.config.exp_ledger.set(args.ledger)
+
+    levelups = 0
+    handle_levelup = cog._handle_levelup
+
+    async def counted_levelup(*args):
+        nonlocal levelups
+        levelups += 1
+        await handle_levelup(*args)
+
+    cog._handle_levelup = counted_levelup
+
+    lags = []
+    lag_task = loop.create_task(measure_lag(lags))
+    step = 1 / args.chat_rate
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        clock.now += step
+        # discord.py runs every listener call as its own task
+        loop.create_task(cog._handle_on_message(message))
+        if args.rate:
+            delay = start + (i + 1) / args.rate - time.perf_counter()
+            await asyncio.sleep(max(0, delay))
+        elif i % args.batch == 0:
+            await asyncio.sleep(0)
+    exp_queue = cog._exp_queue
+    while (
+        cog._message_filter.passed + sum(cog._message_filter.skipped.values())
+        < len(messages)
+        or exp_queue.processed + exp_queue.failed
+        < cog._message_filter.passed - exp_queue.dropped
+    ):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    lag_task.cancel()
+    await cog._credits.close()
+    await cog._ledger.close()
+    exp_queue.close()
+    cog._warmer.close()
+    cog._renderer.close()
+
+    lags.sort()
+    return {
+        "messages": len(messages),
+        "seconds": round(elapsed, 3),
+        "msg_per_s": round(len(messages) / elapsed, 1),
+        "queued": cog._message_filter.passed,
+        "dropped": exp_queue.dropped,
+        "failed": exp_queue.failed,
+        "skipped": dict(cog._message_filter.skipped),
+        "db_ops_per_msg": round(sum(ops.values()) / len(messages), 3),
+        "db_ops": dict(ops),
+        "levelups": levelups,
+        "levelups_per_s": round(levelups / elapsed, 1),
+        "role_edits": FakeMember.edits,
+        "credit_deposits": fake_bank.deposits,
+        "lag_p50_ms": round(percentile(lags, 50) * 1000, 2) if lags else None,
+        "lag_p99_ms": round(percentile(lags, 99) * 1000, 2) if lags else None,
+        "lag_max_ms": round(lags[-1] * 1000, 2) if lags else None,
+    }
+
+
+def format_result(r):
+    skipped = ", ".join(f"{k} {v}" for k, v in sorted(r["skipped"].items()))
+    ops = ", ".join(f"{k} {v}" for k, v in sorted(r["db_ops"].items()))
+    return "\n".join(
+        [
+            f"Messages:   {r['messages']} in {r['seconds']} s, {r['msg_per_s']} msg/s",
+            f"Exp events: {r['queued']} queued, {r['dropped']} dropped, "
+            f"{r['failed']} failed",
+            f"Skipped:    {skipped}",
+            f"DB ops:     {r['db_ops_per_msg']} per message ({ops})",
+            f"Level-ups:  {r['levelups']}, {r['levelups_per_s']}/s, "
+            f"{r['role_edits']} role edits",
+            f"Credits:    {r['credit_deposits']} deposits",
+            f"Loop lag:   {r['lag_p50_ms']} ms p50, {r['lag_p99_ms']} ms p99, "
+            f"{r['lag_max_ms']} ms max",
+        ]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test Leveler message handling.")
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--channels", type=int, default=5, help="per guild")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument(
+        "--chat-rate", type=float, default=5, help="messages per simulated second"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=0, help="messages per second, 0 for no limit"
+    )
+    parser.add_argument(
+        "--batch", type=int, default=10, help="messages between loop iterations"
+    )
+    parser.add_argument(
+        "--linked-levels", type=int, default=5, help="levels with roles per guild"
+    )
+    parser.add_argument("--credits", type=int, default=1, help="credits per message")
+    parser.add_argument("--ledger", action="store_true", help="enable exp ledger")
+    parser.add_argument("--mongo", help="MongoDB URI, mongomock is used without it")
+    parser.add_argument("--save", type=Path, help="write result as JSON to this file")
+    args = parser.parse_args()
+
+    result = asyncio.get_event_loop().run_until_complete(run(args))
+    print(format_result(result))
+    if args.save:
+        result["revision"] = git_revision()
+        result["args"] = {k: v for k, v in vars(args).items() if k != "save"}
+        args.save.write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
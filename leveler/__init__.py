@@ -1,7 +1,13 @@
-from .leveler import Leveler
-
-
 async def setup(bot):
+    # imported here, so render daemon (python -m leveler.daemon) runs without Red
+    from .leveler import Leveler
+
     n = Leveler(bot)
     bot.add_listener(n._handle_on_message, "on_message")
+    for event in (
+        "on_guild_role_create",
+        "on_guild_role_update",
+        "on_guild_role_delete",
+    ):
+        bot.add_listener(n._forget_rewards, event)
     bot.add_cog(n)
@@ -0,0 +1,76 @@
+from collections import OrderedDict, defaultdict
+
+
+class LRUCache:
+    """Least recently used cache, capped by the total size of stored values.
+
+    Entries may be tagged (e.g. with user id) to drop them all at once."""
+
+    def __init__(self, max_size: int, sizeof=len):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._tags = defaultdict(set)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key, default=None):
+        try:
+            value, _size, _tag = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, tag=None):
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+        self.pop(key)
+        self._data[key] = (value, size, tag)
+        self.size += size
+        if tag is not None:
+            self._tags[tag].add(key)
+        while self.size > self.max_size:
+            self.pop(next(iter(self._data)))
+
+    def pop(self, key):
+        try:
+            _value, size, tag = self._data.pop(key)
+        except KeyError:
+            return
+        self.size -= size
+        if tag is not None:
+            self._tags[tag].discard(key)
+            if not self._tags[tag]:
+                del self._tags[tag]
+
+    def invalidate(self, tag):
+        """Drop every entry stored with `tag`."""
+        for key in list(self._tags.get(tag, ())):
+            self.pop(key)
+
+    def clear(self):
+        self._data.clear()
+        self._tags.clear()
+        self.size = 0
+
+    def stats(self):
+        return (
+            f"{len(self)} entries, {self.size / 1024:.1f}/{self.max_size / 1024:.0f} KiB, "
+            f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.1%} hit rate)"
+        )
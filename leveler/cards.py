@@ -0,0 +1,231 @@
+import platform
+
+from .layout import (
+    BadgeGrid,
+    Circle,
+    CircleMask,
+    Fade,
+    Layer,
+    Paste,
+    Rect,
+    Slot,
+    Text,
+    WrappedText,
+)
+
+# Layouts of cards. *_BASE are static parts, cached per user,
+# *_VALUES are drawn over copy of base on every render, their overlay is
+# drawn on copy of base overlay before it's composited, like in one go.
+# *_ASSETS are downloaded images of base: slot -> (placeholder color, size
+# image is scaled to).
+
+UNICODE = "unicode.ttf"
+THIN = "Uni_Sans_Thin.ttf"
+HEAVY = "Uni_Sans_Heavy.ttf"
+UBUNTU = "Ubuntu-R_0.ttf"
+UBUNTU_BOLD = "Ubuntu-B_0.ttf"
+SOURCE_SANS_BOLD = "SourceSansPro-Semibold.ttf"
+
+if "linux" in platform.system().lower():
+    GLOBAL_SYMBOL = "\U0001f30e "
+    LOCAL_SYMBOL = "\U0001f3e0 "
+else:
+    GLOBAL_SYMBOL = "G."
+    LOCAL_SYMBOL = "S. "
+
+# profile: 340x390, info area with avatar, name, title, info and badges on
+# top of background, labels at the bottom
+PROFILE_BASE = Layer(
+    size=(340, 390),
+    base=(Paste(Slot("background"), (0, 0), size=(340, 340), crop=(0, 0, 340, 305)),),
+    overlay=(
+        # filter
+        Rect((0, 0, 340, 340), (0, 0, 0, 10)),
+        # general content
+        Rect((0, 134, 340, 325), Slot("info_fill_tx")),
+        # avatar with border
+        Circle(
+            (14, 48),
+            116,
+            fill=(255, 255, 255, 255),
+            outline=(255, 255, 255, 250),
+        ),
+        Paste(Slot("avatar"), (17, 51), size=(110, 110), mask=CircleMask(110)),
+        Text(
+            Slot("name"),
+            (140, 142),
+            (HEAVY, 30),
+            Slot("info_text_color"),
+            unicode_font=(UNICODE, 30),
+        ),
+        Text(
+            Slot("title"),
+            (140, 170),
+            (HEAVY, 22),
+            Slot("info_text_color"),
+            unicode_font=(UNICODE, 23),
+        ),
+        # divider and text box
+        Rect((0, 323, 340, 324), (0, 0, 0, 255)),
+        Rect((0, 324, 340, 390), Slot("info_box_fill")),
+        Text("❤", (257, 9), (HEAVY, 26), Slot("info_text_color"), (UNICODE, 30)),
+        Text(
+            "    RANK", (0, 362), (UBUNTU_BOLD, 18), Slot("info_text_color"), width=140
+        ),
+        Text(
+            "    LEVEL", (0, 362), (UBUNTU_BOLD, 18), Slot("info_text_color"), width=340
+        ),
+        Text(
+            "BALANCE", (200, 362), (UBUNTU_BOLD, 18), Slot("info_text_color"), width=140
+        ),
+        Text(
+            GLOBAL_SYMBOL,
+            (36, 367),
+            (UBUNTU_BOLD, 18),
+            Slot("info_text_color"),
+            (UNICODE, 15),
+        ),
+        Text(
+            GLOBAL_SYMBOL,
+            (134, 367),
+            (UBUNTU_BOLD, 18),
+            Slot("info_text_color"),
+            (UNICODE, 15),
+        ),
+        WrappedText(
+            Slot("info"),
+            (140, Slot("info_top")),
+            32,
+            (UBUNTU, 14),
+            (UNICODE, 14),
+            Slot("info_text_color"),
+        ),
+        BadgeGrid(
+            (9, 172),
+            Slot("badges"),
+            size=38,
+            columns=3,
+            count=9,
+            gap=(6, 6),
+            border=2,
+            raw_length=228,
+            slot_fill=Slot("badge_slot_fill"),
+            plus_fill=Slot("badge_plus_fill"),
+            when="badge_circles",
+        ),
+        # level box
+        Rect((0, 305, 340, 323), Slot("level_fill")),
+    ),
+)
+PROFILE_ASSETS = {
+    "background": ((35, 35, 35, 255), (340, 340)),
+    "avatar": ((128, 128, 128, 255), (110, 110)),
+}
+BADGE_SIZE = (228, 228)
+PROFILE_VALUES = Layer(
+    size=(340, 390),
+    overlay=(
+        Text(Slot("rep"), (278, 10), (HEAVY, 26), Slot("info_text_color"), width=62),
+        Text(Slot("rank"), (0, 335), (THIN, 33), Slot("info_text_color"), width=140),
+        Text(Slot("level"), (0, 335), (THIN, 33), Slot("info_text_color"), width=340),
+        # level bar
+        Rect((0, 305, Slot("bar_length"), 323), Slot("exp_fill")),
+        Text(
+            Slot("exp"), (0, 305), (UBUNTU_BOLD, 13), Slot("exp_text_color"), width=340
+        ),
+        Text(
+            Slot("credits"), (200, 335), (THIN, 33), Slot("info_text_color"), width=140
+        ),
+    ),
+    corners=25,
+)
+
+# rank: 390x100, level circle with avatar on the left of info section
+RANK_INFO_TEXT = (220, 220, 220, 255)
+RANK_INFO = Layer(
+    size=(340, 100),
+    base=(Paste(Slot("background"), (0, 0), size=(390, 100)),),
+    overlay=(
+        Rect((0, 0, 340, 20), (230, 230, 230, 200)),
+        # level bar
+        Rect((0, 20, 340, 30), (120, 120, 120, 180)),
+        # second variant of base has full exp bar, it's cut to exp width
+        Rect((0, 20, Slot("bar_width"), 30), Slot("exp_color"), when="bar_width"),
+        # divider
+        Rect((0, 30, 340, 31), (0, 0, 0, 255)),
+        # title overlay
+        Fade(0, 340, 100, 70, (20, 20, 20)),
+    ),
+    corners=25,
+)
+RANK_BASE = Layer(
+    size=(390, 100),
+    overlay=(
+        Paste(RANK_INFO, (35, 0)),
+        Circle((0, 0), 100, fill=(250, 250, 250, 250)),
+        Paste(Slot("avatar"), (3, 3), size=(94, 94), mask=CircleMask(94)),
+        Text(
+            Slot("name"),
+            (100, 0),
+            (HEAVY, 24),
+            (100, 100, 100, 255),
+            unicode_font=(UNICODE, 24),
+        ),
+        Text("  RANK", (100, 75), (SOURCE_SANS_BOLD, 16), RANK_INFO_TEXT, width=100),
+        Text("  LEVEL", (100, 75), (SOURCE_SANS_BOLD, 16), RANK_INFO_TEXT, width=260),
+        Text("BALANCE", (260, 75), (SOURCE_SANS_BOLD, 16), RANK_INFO_TEXT, width=100),
+        Text(
+            LOCAL_SYMBOL,
+            (117, 79),
+            (SOURCE_SANS_BOLD, 16),
+            RANK_INFO_TEXT,
+            (UNICODE, 15),
+        ),
+        Text(
+            LOCAL_SYMBOL,
+            (195, 79),
+            (SOURCE_SANS_BOLD, 16),
+            RANK_INFO_TEXT,
+            (UNICODE, 15),
+        ),
+    ),
+)
+RANK_ASSETS = {
+    "background": ((35, 35, 35, 255), (390, 100)),
+    "avatar": ((128, 128, 128, 255), (94, 94)),
+}
+RANK_BAR_WIDTH = 340
+RANK_VALUES = Layer(
+    size=(390, 100),
+    base=(
+        # exp bar, divider covers its last line
+        Paste(Slot("exp_bar"), (35, 20)),
+        Text(Slot("rank"), (100, 45), (THIN, 24), RANK_INFO_TEXT, width=100),
+        Text(Slot("level"), (95, 45), (THIN, 24), RANK_INFO_TEXT, width=265),
+        Text(Slot("credits"), (260, 45), (THIN, 24), RANK_INFO_TEXT, width=100),
+        Text(Slot("exp"), (80, 19), (SOURCE_SANS_BOLD, 9), RANK_INFO_TEXT, width=280),
+    ),
+)
+
+# level-up: 176x67, avatar and level number
+LEVELUP_BASE = Layer(
+    size=(176, 67),
+    base=(Paste(Slot("background"), (0, 0), size=(176, 67)),),
+    overlay=(
+        # info section
+        Paste(Layer((165, 55), background=(230, 230, 230, 20), corners=30), (1, 1)),
+        # title overlay
+        Fade(0, 176, 67, 67, Slot("info_color")),
+        Circle((4, 3), 60, fill=(250, 250, 250, 180)),
+        Paste(Slot("avatar"), (5, 4), size=(58, 58), mask=CircleMask(58)),
+    ),
+)
+LEVELUP_ASSETS = {
+    "background": ((35, 35, 35, 255), (176, 67)),
+    "avatar": ((128, 128, 128, 255), (58, 58)),
+}
+LEVELUP_VALUES = Layer(
+    size=(176, 67),
+    overlay=(Text(Slot("level"), (60, 23), (THIN, 23), Slot("text_color"), width=110),),
+    corners=33,
+)
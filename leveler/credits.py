@@ -0,0 +1,66 @@
+import asyncio
+import logging
+
+from redbot.core import bank
+
+log = logging.getLogger("red.fixator10-cogs.leveler")
+
+
+class CreditBatcher:
+    """Deposits message credits in batches.
+
+    Credits are summed per member and deposited every `interval` seconds,
+    exp cooldown lets member earn them at most every 120 seconds, so only
+    interval much longer than that saves deposits. Everything is deposited
+    early only if `max_pending` members have credits waiting, to bound memory.
+    `close` returns the last flush, that has to be awaited so no credits are
+    lost."""
+
+    def __init__(self, loop, interval: float = 600, max_pending: int = 100000):
+        self.loop = loop
+        self.interval = interval
+        self.max_pending = max_pending
+        # (guild id, user id) -> [member, credits]
+        self._pending = {}
+        self._task = loop.create_task(self._run())
+        self.messages = 0
+        self.deposits = 0
+        self.failed = 0
+
+    def add(self, member, amount: int):
+        entry = self._pending.get((member.guild.id, member.id))
+        if entry is None:
+            self._pending[(member.guild.id, member.id)] = [member, amount]
+        else:
+            entry[0] = member
+            entry[1] += amount
+        self.messages += 1
+        if len(self._pending) == self.max_pending:
+            self.loop.create_task(self.flush())
+
+    async def flush(self):
+        # credits added while depositing wait for the next flush
+        pending, self._pending = self._pending, {}
+        for member, amount in pending.values():
+            try:
+                await bank.deposit_credits(member, amount)
+            except Exception:
+                self.failed += 1
+                log.exception(f"Unable to deposit {amount} message credits")
+            else:
+                self.deposits += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def stats(self):
+        return (
+            f"Message credits: {self.messages} messages, {self.deposits} deposits, "
+            f"{self.failed} failed, {len(self._pending)} members pending"
+        )
+
+    def close(self):
+        self._task.cancel()
+        return self.flush()
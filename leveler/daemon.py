@@ -0,0 +1,207 @@
+"""Render daemon for Leveler cards, shared by several bot processes.
+
+    python -m leveler.daemon --socket /run/leveler/render.sock --workers 4
+
+Run it from the directory the cog is installed in, it needs only the cog
+requirements, not Red. Then point every bot to the socket with
+`[p]lvladmin renderdaemon /run/leveler/render.sock`. Dead workers are
+restarted.
+Every worker is a separate process with its own font, mask and static
+layer caches, they accept connections from the same socket.
+Bots render cards themselves while the daemon is not available."""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import time
+from pathlib import Path
+
+import aiohttp
+
+from .cache import LRUCache
+from .render import ASSET_CONNECTIONS_PER_HOST, CardRenderer, layers_size
+from .timing import StageTimer
+
+log = logging.getLogger("red.fixator10-cogs.leveler")
+
+FONT_DIR = str(Path(__file__).resolve().parent / "data")
+RENDER_TIMEOUT = 30  # seconds, whole request including downloads
+RETRY_AFTER = 30  # seconds without trying daemon after it was unreachable
+WORKER_CHECK_INTERVAL = 1  # seconds between checks for dead render workers
+
+# Every message is a frame: 4 bytes of big-endian length, then payload.
+# Request is JSON frame with render request (see CardRenderer). Response is
+# JSON frame {"stages": {stage: seconds}, "complete": bool} followed by frame
+# with card, or just {"error": message}.
+_LENGTH = struct.Struct("!I")
+
+
+async def read_frame(reader):
+    (length,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+    return await reader.readexactly(length)
+
+
+def write_frame(writer, payload: bytes):
+    writer.write(_LENGTH.pack(len(payload)) + payload)
+
+
+class DaemonUnavailable(Exception):
+    pass
+
+
+class RenderClient:
+    """Sends render requests to daemon listening on `path`."""
+
+    def __init__(self, path: str, timeout: float = RENDER_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._retry_at = 0
+        self.rendered = 0
+        self.failed = 0
+
+    async def render(self, request, timer=None):
+        """(card, complete) rendered by daemon, like CardRenderer.render.
+
+        DaemonUnavailable is raised if it can't render it."""
+        loop = asyncio.get_event_loop()
+        if loop.time() < self._retry_at:
+            raise DaemonUnavailable("daemon was unreachable recently")
+        try:
+            response, data = await asyncio.wait_for(
+                self._request(request), self.timeout
+            )
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            self.failed += 1
+            self._retry_at = loop.time() + RETRY_AFTER
+            raise DaemonUnavailable(f"{type(e).__name__}: {e}")
+        if timer is not None:
+            timer.merge(response["stages"], "ipc")
+        self.rendered += 1
+        return data, response["complete"]
+
+    async def _request(self, request):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        try:
+            write_frame(writer, json.dumps(request).encode())
+            await writer.drain()
+            response = json.loads(await read_frame(reader))
+            if "error" in response:
+                self.failed += 1
+                raise DaemonUnavailable(response["error"])
+            return response, await read_frame(reader)
+        finally:
+            writer.close()
+
+    def stats(self):
+        return (
+            f"Render daemon: {self.path}, {self.rendered} rendered, "
+            f"{self.failed} failed"
+        )
+
+
+async def _handle(renderer, reader, writer):
+    try:
+        while True:
+            try:
+                request = json.loads(await read_frame(reader))
+            except asyncio.IncompleteReadError:
+                break  # client is done
+            timer = StageTimer(None, request.get("card"))
+            try:
+                data, complete = await renderer.render(request, timer)
+            except Exception as e:
+                log.exception("Unable to render card")
+                write_frame(writer, json.dumps({"error": str(e)}).encode())
+            else:
+                response = {"stages": timer.stages, "complete": complete}
+                write_frame(writer, json.dumps(response).encode())
+                write_frame(writer, data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def _start(sock, cache_size):
+    # session has to be created in running loop
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit_per_host=ASSET_CONNECTIONS_PER_HOST)
+    )
+    renderer = CardRenderer(FONT_DIR, session, LRUCache(cache_size, layers_size))
+    await asyncio.start_unix_server(
+        lambda reader, writer: _handle(renderer, reader, writer), sock=sock
+    )
+    return session
+
+
+def _serve(sock, cache_size):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    session = loop.run_until_complete(_start(sock, cache_size))
+    log.info(f"Render worker {os.getpid()} is ready")
+    try:
+        loop.run_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        loop.run_until_complete(session.close())
+
+
+def _stop(signum, frame):
+    raise SystemExit
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render daemon for Leveler cards.")
+    parser.add_argument("--socket", required=True, help="path of Unix socket")
+    parser.add_argument("--workers", type=int, default=2, help="render processes")
+    parser.add_argument(
+        "--cache", type=int, default=64, help="static layer cache per worker, MiB"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(process)d %(message)s"
+    )
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)  # left by previous run
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(args.socket)
+    sock.listen(128)
+    # stop gracefully on SIGTERM too, workers inherit this handler
+    signal.signal(signal.SIGTERM, _stop)
+    # workers inherit listening socket, kernel spreads connections between them
+    context = multiprocessing.get_context("fork")
+    cache_size = args.cache * 1024 * 1024
+    workers = []
+    try:
+        while True:
+            # dead workers are replaced, others keep serving meanwhile
+            for worker in [worker for worker in workers if not worker.is_alive()]:
+                log.error(
+                    f"Render worker {worker.pid} exited with {worker.exitcode}, "
+                    "starting new one"
+                )
+                workers.remove(worker)
+            while len(workers) < args.workers:
+                worker = context.Process(target=_serve, args=(sock, cache_size))
+                worker.start()
+                workers.append(worker)
+            time.sleep(WORKER_CHECK_INTERVAL)
+    except KeyboardInterrupt:
+        pass  # workers got it too
+    finally:
+        for worker in workers:
+            worker.terminate()
+        sock.close()
+        os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
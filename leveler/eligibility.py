@@ -0,0 +1,84 @@
+import time
+from collections import Counter, namedtuple
+
+_GuildState = namedtuple("_GuildState", "disabled ignored_channels prefixes expires")
+
+
+class MessageFilter:
+    """Decides from memory whether message may give exp.
+
+    Guild settings and prefixes come from `load_guild(message)` coroutine
+    (disabled, ignored channel ids, prefixes), they are reloaded every `ttl`
+    seconds or after `forget_guild`. Exp cooldowns are remembered from
+    `gave_exp`, users that are not remembered are checked in database later.
+    Skipped messages are counted by reason."""
+
+    def __init__(self, load_guild, cooldown: int = 120, ttl: int = 300):
+        self._load_guild = load_guild
+        self.cooldown = cooldown
+        self.ttl = ttl
+        self._guilds = {}
+        # user id -> (time, content) of last message that gave exp
+        self._last_exp = {}
+        self._prune_at = 1024
+        self.passed = 0
+        self.skipped = Counter()
+
+    async def check(self, message):
+        reason = await self._skip_reason(message)
+        if reason is None:
+            self.passed += 1
+            return True
+        self.skipped[reason] += 1
+        return False
+
+    async def _skip_reason(self, message):
+        # cheapest checks first, only first message of guild in `ttl` awaits
+        if message.guild is None:
+            return "direct message"
+        if message.author.bot:
+            return "bot"
+        content = message.content
+        if len(content) <= 10 and not message.attachments:
+            return "too short"
+        now = time.time()
+        last_exp = self._last_exp.get(message.author.id)
+        if last_exp is not None:
+            if now - last_exp[0] < self.cooldown:
+                return "cooldown"
+            if content == last_exp[1]:
+                return "repeated"
+        guild = self._guilds.get(message.guild.id)
+        if guild is None or guild.expires < now:
+            guild = _GuildState(*await self._load_guild(message), now + self.ttl)
+            self._guilds[message.guild.id] = guild
+        if guild.disabled:
+            return "disabled"
+        if message.channel.id in guild.ignored_channels:
+            return "ignored channel"
+        if content.startswith(guild.prefixes):
+            return "command"
+        return None
+
+    def gave_exp(self, user_id, content):
+        now = time.time()
+        self._last_exp[user_id] = (now, content)
+        if len(self._last_exp) >= self._prune_at:
+            # users out of cooldown are checked in database again
+            self._last_exp = {
+                user: last_exp
+                for user, last_exp in self._last_exp.items()
+                if now - last_exp[0] < self.cooldown
+            }
+            self._prune_at = max(1024, 2 * len(self._last_exp))
+
+    def forget_guild(self, guild_id):
+        self._guilds.pop(guild_id, None)
+
+    def stats(self):
+        skipped = sum(self.skipped.values())
+        lines = [f"Messages: {self.passed} checked for exp, {skipped} skipped"]
+        lines.extend(
+            f"  {reason}: {count}" for reason, count in self.skipped.most_common()
+        )
+        return "\n".join(lines)
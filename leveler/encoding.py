@@ -0,0 +1,44 @@
+import time
+from io import BytesIO
+
+from PIL import Image
+
+CARD_FORMATS = ("png", "webp")
+
+# (label, format, png compress level, quantize) for benchmarks
+BENCHMARK_MODES = [
+    ("png, level 1", "png", 1, False),
+    ("png, level 6", "png", 6, False),
+    ("png, level 9", "png", 9, False),
+    ("png, level 6, 256 colors", "png", 6, True),
+    ("png, level 9, 256 colors", "png", 9, True),
+    ("webp, lossless", "webp", None, False),
+]
+
+
+def encode_card(image, card_format="png", compress_level=6, quantize=False):
+    """Encode finished card to bytes in chosen format."""
+    file = BytesIO()
+    if card_format == "webp":
+        image.save(file, "WEBP", lossless=True)
+    else:
+        if quantize:
+            # only fast octree supports RGBA images
+            image = image.quantize(256, method=Image.FASTOCTREE)
+        image.save(file, "PNG", compress_level=compress_level)
+    return file.getvalue()
+
+
+def benchmark(images: dict, rounds: int = 5):
+    """Average encode time (ms) and size (bytes) of every mode for every image.
+
+    Returns list of (card name, mode label, ms, bytes)."""
+    results = []
+    for name, image in images.items():
+        for label, card_format, compress_level, quantize in BENCHMARK_MODES:
+            start = time.perf_counter()
+            for _ in range(rounds):
+                data = encode_card(image, card_format, compress_level, quantize)
+            elapsed = (time.perf_counter() - start) / rounds * 1000
+            results.append((name, label, elapsed, len(data)))
+    return results
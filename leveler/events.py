@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+log = logging.getLogger("red.fixator10-cogs.leveler")
+
+
+class ExpQueue:
+    """Processes exp events outside of message listener.
+
+    Events are spread between `shards` bounded queues by guild, each queue
+    is drained by its own worker, so events of one guild are processed in
+    order and a slow guild holds up only its shard. When queue of a shard
+    is full, new events are dropped and counted, listener never waits."""
+
+    def __init__(self, loop, handler, shards: int = 4, size: int = 500, samples=1000):
+        self.loop = loop
+        self.handler = handler
+        self._queues = [asyncio.Queue(maxsize=size) for _ in range(shards)]
+        self._workers = [loop.create_task(self._worker(q)) for q in self._queues]
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.wait_times = deque(maxlen=samples)
+
+    def put(self, guild_id, event):
+        """Queue `event` for handler, False if it was dropped."""
+        queue = self._queues[guild_id % len(self._queues)]
+        try:
+            queue.put_nowait((time.monotonic(), event))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        return True
+
+    async def _worker(self, queue):
+        while True:
+            queued_at, event = await queue.get()
+            self.wait_times.append(time.monotonic() - queued_at)
+            try:
+                await self.handler(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+                log.exception("Unable to process exp event")
+            else:
+                self.processed += 1
+
+    def stats(self):
+        waits = sorted(self.wait_times)
+        if waits:
+            wait = (
+                f"{waits[len(waits) // 2] * 1000:.0f} ms p50, "
+                f"{waits[-1] * 1000:.0f} ms max"
+            )
+        else:
+            wait = "no samples"
+        depths = ", ".join(str(queue.qsize()) for queue in self._queues)
+        return (
+            f"Exp queues: {depths} (of {self._queues[0].maxsize})\n"
+            f"Events: {self.processed} processed, {self.dropped} dropped, "
+            f"{self.failed} failed\n"
+            f"Queue wait: {wait}"
+        )
+
+    def close(self):
+        # queued events are lost, like messages sent while cog is unloaded
+        for worker in self._workers:
+            worker.cancel()
@@ -0,0 +1,46 @@
+from functools import lru_cache
+
+from fontTools.ttLib import TTFont
+from PIL import ImageFont
+
+# Fonts are cached, so same (path, size) is always the same object and can be
+# used as a cache key for text measured with it.
+
+
+@lru_cache(maxsize=64)
+def load_font(path: str, size: int):
+    return ImageFont.truetype(path, size)
+
+
+@lru_cache(maxsize=16)
+def font_charset(path: str):
+    """Code points covered by unicode cmap tables of font at `path`."""
+    charset = set()
+    for cmap in TTFont(path)["cmap"].tables:
+        if cmap.isUnicode():
+            charset.update(cmap.cmap)
+    return frozenset(charset)
+
+
+@lru_cache(maxsize=2048)
+def text_runs(text: str, font, unicode_font):
+    """Split `text` into maximal runs drawn with a single font.
+
+    Characters missing in `font` fall back to `unicode_font`.
+    Returns tuple of (run, font, width)."""
+    charset = font_charset(font.path)
+    runs = []
+    for char in text:
+        char_font = font if ord(char) in charset else unicode_font
+        if runs and runs[-1][1] is char_font:
+            runs[-1][0] += char
+        else:
+            runs.append([char, char_font])
+    return tuple((run, run_font, run_font.getsize(run)[0]) for run, run_font in runs)
+
+
+def write_unicode(draw, text, x, y, font, unicode_font, fill):
+    """Draw `text` at (x, y), using `unicode_font` for chars `font` lacks."""
+    for run, run_font, width in text_runs(text, font, unicode_font):
+        draw.text((x, y), run, font=run_font, fill=fill)
+        x += width
@@ -0,0 +1,314 @@
+import textwrap
+from functools import lru_cache
+from typing import Any, NamedTuple
+
+from PIL import Image, ImageDraw, ImageOps
+
+from . import masks
+from .fonts import load_font, write_unicode
+
+# Cards are described as layers of ops (see cards.py), compiled once per layout
+# into a plan, that is replayed with values of slots for every card.
+# Layouts are made of named tuples, so equal layouts (and sub-layers) share
+# one compiled plan, even when used by different cards.
+
+
+class Slot(NamedTuple):
+    """Value given when card is drawn."""
+
+    name: str
+
+
+class CircleMask(NamedTuple):
+    size: int
+
+
+class Rect(NamedTuple):
+    box: tuple  # (x0, y0, x1, y1)
+    fill: Any
+    when: str = None  # name of slot, op is skipped if its value is falsy
+
+
+class Fade(NamedTuple):
+    """Lines going up from `bottom`, every next one `step` more transparent."""
+
+    x0: int
+    x1: int
+    bottom: int
+    lines: int
+    color: Any  # RGB
+    step: int = 3
+
+
+class Circle(NamedTuple):
+    """Antialiased filled circle."""
+
+    xy: tuple
+    diameter: int
+    fill: tuple
+    outline: tuple = None
+
+
+class Paste(NamedTuple):
+    source: Any  # Slot with image or Layer
+    xy: tuple
+    size: tuple = None  # resize to
+    crop: tuple = None  # after resize
+    mask: CircleMask = None
+    when: str = None
+
+
+class Text(NamedTuple):
+    text: Any
+    xy: tuple
+    font: tuple  # (file in data folder, size)
+    fill: Any
+    unicode_font: tuple = None  # for chars missing in font
+    width: int = None  # center text in (x, x + width)
+
+
+class WrappedText(NamedTuple):
+    text: Any
+    xy: tuple
+    columns: int
+    font: tuple
+    unicode_font: tuple
+    fill: Any
+    spacing: int = 2
+
+
+class BadgeGrid(NamedTuple):
+    """Circles with badges, slot value is list of (image or None, border color).
+
+    Badges without image are left empty, free slots get plus sign."""
+
+    xy: tuple
+    badges: Slot
+    size: int
+    columns: int
+    count: int
+    gap: tuple
+    border: int
+    raw_length: int  # badges are fitted at this size before downsampling
+    slot_fill: Any
+    plus_fill: Any
+    when: str = None
+
+
+class Layer(NamedTuple):
+    size: tuple
+    base: tuple = ()  # drawn right on the layer
+    overlay: tuple = ()  # drawn on transparent layer, that is composited over base
+    background: tuple = (255, 255, 255, 0)
+    corners: int = None  # radius of rounded corners
+
+
+def _resolve(value, values):
+    if isinstance(value, Slot):
+        return values[value.name]
+    if type(value) is tuple:
+        return tuple(_resolve(v, values) for v in value)
+    return value
+
+
+@lru_cache(maxsize=32)
+def _fade_strip(width: int, alphas: tuple, color: tuple):
+    strip = Image.new("RGBA", (width, len(alphas)))
+    draw = ImageDraw.Draw(strip)
+    for y, alpha in enumerate(alphas):
+        draw.rectangle([(0, y), (width, y)], fill=color + (alpha,))
+    return strip
+
+
+class Plan:
+    """Compiled layer: list of (stage, step), where step draws on image."""
+
+    def __init__(self, layer, steps, overlay):
+        self.layer = layer
+        self.steps = steps
+        self.overlay = overlay
+
+    def draw(self, values, image=None, timer=None, process=None):
+        """Layer drawn on `image`, overlay is drawn on `process` if given."""
+        layer = self.layer
+        if image is None:
+            image = Image.new("RGBA", layer.size, layer.background)
+        self._run(self.steps, image, values, timer)
+        if self.overlay:
+            if process is None:
+                process = Image.new("RGBA", layer.size, (255, 255, 255, 0))
+            self._run(self.overlay, process, values, timer)
+            image = Image.alpha_composite(image, process)
+        if layer.corners:
+            image.putalpha(masks.corner_alpha(image.size, layer.corners))
+        return image
+
+    def draw_parts(self, values, timer=None):
+        """(layer, overlay) of layer, not composited yet."""
+        image = Image.new("RGBA", self.layer.size, self.layer.background)
+        self._run(self.steps, image, values, timer)
+        process = Image.new("RGBA", self.layer.size, (255, 255, 255, 0))
+        self._run(self.overlay, process, values, timer)
+        return image, process
+
+    @staticmethod
+    def _run(steps, image, values, timer):
+        draw = ImageDraw.Draw(image)
+        for stage, step in steps:
+            step(image, draw, values, timer)
+            if timer is not None:
+                timer.lap(stage)
+
+
+def _compile_op(op, layer, font_dir):
+    """(stage, step) for op."""
+
+    def font(spec):
+        return spec and load_font(f"{font_dir}/{spec[0]}", spec[1])
+
+    if isinstance(op, Rect):
+
+        def step(image, draw, values, timer):
+            if op.when is None or values.get(op.when):
+                draw.rectangle(_resolve(op.box, values), fill=_resolve(op.fill, values))
+
+        return "compose", step
+
+    if isinstance(op, Fade):
+        width = min(op.x1 + 1, layer.size[0]) - op.x0
+        rows = [
+            (op.bottom - i, 255 - i * op.step)
+            for i in range(op.lines)
+            if 0 <= op.bottom - i < layer.size[1]
+        ]
+        top = min(y for y, _ in rows)
+        alphas = tuple(alpha for _, alpha in sorted(rows))
+
+        def step(image, draw, values, timer):
+            strip = _fade_strip(width, alphas, _resolve(op.color, values)[:3])
+            image.paste(strip, (op.x0, top))
+
+        return "compose", step
+
+    if isinstance(op, Circle):
+        circle = masks.filled_circle(op.diameter, op.fill, op.outline)
+        circle_mask = masks.circle_mask(op.diameter)
+
+        def step(image, draw, values, timer):
+            image.paste(circle, op.xy, circle_mask)
+
+        return "compose", step
+
+    if isinstance(op, Paste):
+        mask = op.mask and masks.circle_mask(*op.mask)
+        plan = (
+            compile_layout(op.source, font_dir)
+            if isinstance(op.source, Layer)
+            else None
+        )
+
+        def step(image, draw, values, timer):
+            if op.when is not None and not values.get(op.when):
+                return
+            if plan is not None:
+                source = plan.draw(values, timer=timer)
+            else:
+                source = _resolve(op.source, values)
+            if op.size is not None:
+                source = source.resize(op.size, Image.ANTIALIAS)
+            if op.crop is not None:
+                source = source.crop(op.crop)
+            if mask is not None:
+                image.paste(source, op.xy, mask)
+            else:
+                image.paste(source, op.xy)
+
+        return "compose", step
+
+    if isinstance(op, Text):
+        text_font = font(op.font)
+        unicode_font = font(op.unicode_font)
+
+        def step(image, draw, values, timer):
+            text = _resolve(op.text, values)
+            x, y = _resolve(op.xy, values)
+            fill = _resolve(op.fill, values)
+            if op.width is not None:
+                x = int(x + (op.width - text_font.getsize(text)[0]) / 2)
+            if unicode_font is not None:
+                write_unicode(draw, text, x, y, text_font, unicode_font, fill)
+            else:
+                draw.text((x, y), text, font=text_font, fill=fill)
+
+        return "text", step
+
+    if isinstance(op, WrappedText):
+        text_font = font(op.font)
+        unicode_font = font(op.unicode_font)
+
+        def step(image, draw, values, timer):
+            x, y = _resolve(op.xy, values)
+            fill = _resolve(op.fill, values)
+            for line in textwrap.wrap(_resolve(op.text, values), width=op.columns):
+                write_unicode(draw, line, x, y, text_font, unicode_font, fill)
+                y += text_font.getsize(line)[1] + op.spacing
+
+        return "text", step
+
+    if isinstance(op, BadgeGrid):
+        size = op.size
+        inner_size = size - 2 * op.border
+        outer_mask = masks.circle_mask(size)
+        inner_mask = masks.circle_mask(inner_size)
+
+        def step(image, draw, values, timer):
+            if op.when is not None and not values.get(op.when):
+                return
+            badges = _resolve(op.badges, values)
+            for num in range(op.count):
+                coord = (
+                    op.xy[0] + num % op.columns * (op.gap[0] + size),
+                    op.xy[1] + num // op.columns * (op.gap[1] + size),
+                )
+                if num >= len(badges):
+                    plus = masks.plus_badge(
+                        size,
+                        _resolve(op.slot_fill, values),
+                        _resolve(op.plus_fill, values),
+                    )
+                    image.paste(plus, coord, outer_mask)
+                    continue
+                badge_image, border_color = badges[num]
+                if badge_image is None:
+                    continue
+                raw_size = (op.raw_length, op.raw_length)
+                badge_image = badge_image.resize(raw_size, Image.ANTIALIAS)
+                output = ImageOps.fit(badge_image, raw_size, centering=(0.5, 0.5))
+                # structured like this because if border = 0, still leaves outline.
+                if border_color:
+                    image.paste(
+                        border_color,
+                        coord + (coord[0] + size, coord[1] + size),
+                        outer_mask,
+                    )
+                    output = output.resize((inner_size, inner_size), Image.ANTIALIAS)
+                    image.paste(
+                        output, (coord[0] + op.border, coord[1] + op.border), inner_mask
+                    )
+                else:
+                    output = output.resize((size, size), Image.ANTIALIAS)
+                    image.paste(output, coord, outer_mask)
+
+        return "compose", step
+
+    raise TypeError(f"Unknown layout op: {op!r}")
+
+
+@lru_cache(maxsize=32)
+def compile_layout(layer: Layer, font_dir: str):
+    """Plan of layer, fonts are loaded from `font_dir`."""
+    return Plan(
+        layer,
+        [_compile_op(op, layer, font_dir) for op in layer.base],
+        [_compile_op(op, layer, font_dir) for op in layer.overlay],
+    )
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+from itertools import groupby
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+log = logging.getLogger("red.fixator10-cogs.leveler")
+
+DUPLICATE_KEY = 11000
+
+
+class ExpLedger:
+    """Append-only log of exp changes, to rebuild exp of users from.
+
+    Every change is an event {"t": time, "g": guild id, "u": user id,
+    "d": exp} in `exp_ledger` collection. `record` only keeps events in
+    memory, they are written in batches every `interval` seconds, events
+    that failed to write are retried. Every `compact_interval` seconds
+    events are summed into `exp_totals` (one document per guild and
+    user) and deleted. Compaction cutoff is saved in `exp_ledger_state`
+    before totals are changed, and every total remembers cutoff it was
+    compacted to, so interrupted compaction is finished without counting
+    events twice. Events are not written while compaction runs, so none
+    are deleted before they are counted. Database work runs in executor.
+    Exp that is not from any guild is kept under guild ""."""
+
+    def __init__(
+        self,
+        loop,
+        db,
+        interval: float = 10,
+        compact_interval: float = 60 * 60,
+    ):
+        self.loop = loop
+        self.events = db.exp_ledger
+        self.totals = db.exp_totals
+        self.state = db.exp_ledger_state
+        self.interval = interval
+        self.compact_interval = compact_interval
+        self._pending = []
+        self._writing = asyncio.Lock()
+        self._compacted_at = loop.time()
+        self._task = loop.create_task(self._periodic())
+        self.recorded = 0
+        self.compactions = 0
+
+    def record(self, guild_id, user_id, delta: int):
+        self._pending.append(
+            {"t": time.time(), "g": str(guild_id), "u": str(user_id), "d": delta}
+        )
+        self.recorded += 1
+
+    async def flush(self):
+        """Write pending events, failed ones are kept for the next flush."""
+        async with self._writing:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        failed = await self._run(self._insert, pending)
+        self._pending = failed + self._pending
+
+    def _insert(self, pending):
+        """Events of `pending` that failed to write."""
+        try:
+            self.events.insert_many(pending, ordered=False)
+        except BulkWriteError as e:
+            # unordered insert writes everything else, and events retried after
+            # unknown outcome already have their _id, so duplicates are written
+            failed = {
+                error["index"]
+                for error in e.details["writeErrors"]
+                if error["code"] != DUPLICATE_KEY
+            }
+            if failed:
+                log.error(f"Unable to write {len(failed)} exp ledger events: {e}")
+            return [pending[i] for i in sorted(failed)]
+        except PyMongoError:
+            log.exception("Unable to write exp ledger")
+            return pending
+        return []
+
+    async def compact(self):
+        """Write pending events and sum written ones into totals."""
+        async with self._writing:
+            await self._flush()
+            await self._run(self._compact)
+        self._compacted_at = self.loop.time()
+        self.compactions += 1
+
+    async def _run(self, func, *args):
+        future = self.loop.run_in_executor(None, func, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # lock is held until database work is done, even when cancelled
+            await future
+            raise
+
+    def _compact(self):
+        state = self.state.find_one({"_id": "compaction"})
+        # cutoff of interrupted compaction is reused, its events are still there
+        cutoff = state["cutoff"] if state else time.time()
+        self.state.update_one(
+            {"_id": "compaction"}, {"$set": {"cutoff": cutoff}}, upsert=True
+        )
+        sums = self.events.aggregate(
+            [
+                {"$match": {"t": {"$lte": cutoff}}},
+                {"$group": {"_id": {"g": "$g", "u": "$u"}, "d": {"$sum": "$d"}}},
+            ]
+        )
+        for total in sums:
+            guild_id, user_id = total["_id"]["g"], total["_id"]["u"]
+            try:
+                self.totals.update_one(
+                    # total already compacted to cutoff doesn't match,
+                    # and its upsert fails
+                    {"_id": f"{guild_id}:{user_id}", "until": {"$lt": cutoff}},
+                    {
+                        "$inc": {"exp": total["d"]},
+                        "$set": {"g": guild_id, "u": user_id, "until": cutoff},
+                    },
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                pass
+        self.events.delete_many({"t": {"$lte": cutoff}})
+        self.state.delete_one({"_id": "compaction"})
+
+    async def start(self, totals):
+        """Drop everything and start from `totals`, [(guild id, user id, exp)]."""
+        async with self._writing:
+            self._pending = []
+            return await self._run(self._start, totals)
+
+    def _start(self, totals):
+        self.events.delete_many({})
+        self.state.delete_many({})
+        self.totals.delete_many({})
+        self.totals.create_index("u")
+        now = time.time()
+        documents = [
+            {"_id": f"{g}:{u}", "g": str(g), "u": str(u), "exp": exp, "until": now}
+            for g, u, exp in totals
+        ]
+        if documents:
+            self.totals.insert_many(documents, ordered=False)
+        return len(documents)
+
+    def users(self):
+        """(user id, {guild id: exp}) of every user, from compacted totals.
+
+        Totals are streamed in user id order, one user at a time."""
+        # index lets the sort stream, instead of sorting all totals in memory
+        self.totals.create_index("u")
+        cursor = self.totals.find({}, {"g": 1, "u": 1, "exp": 1}).sort("u", 1)
+        for user_id, totals in groupby(cursor, key=lambda total: total["u"]):
+            yield user_id, {total["g"]: total["exp"] for total in totals}
+
+    async def _periodic(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if self.loop.time() - self._compacted_at >= self.compact_interval:
+                    await self.compact()
+                else:
+                    await self.flush()
+            except Exception:
+                log.exception("Unable to write exp ledger")
+
+    def stats(self):
+        return (
+            f"Exp ledger: {self.recorded} events recorded, {len(self._pending)} "
+            f"pending, {self.compactions} compactions"
+        )
+
+    async def close(self):
+        self._task.cancel()
+        await self.flush()
@@ -1,19 +1,19 @@
+import hashlib
+import json
 import logging
 import operator
-import platform
 import random
 import re
-import textwrap
 import time
-from asyncio import TimeoutError as AsyncTimeoutError
+from asyncio import TimeoutError as AsyncTimeoutError, wait
 from collections import OrderedDict
 from io import BytesIO
 
 import aiohttp
 import discord
 import math
+from functools import partial
 from discord.utils import find
-from fontTools.ttLib import TTFont
 from redbot.core import bank
 from redbot.core import checks
 from redbot.core import commands
@@ -28,18 +28,36 @@ try:
 except Exception as e:
     raise RuntimeError("Can't load pymongo:{e}\nInstall 'pymongo' package")
 try:
-    import scipy
-    import scipy.misc
-    import scipy.cluster
-except Exception as e:
-    print(
-        f"{__file__}: scipy is unable to import: {e}\nAutocolor feature will be unavailable"
-    )
-try:
-    from PIL import Image, ImageDraw, ImageFont, ImageColor, ImageOps, ImageFilter
+    from PIL import Image, ImageDraw, ImageFont, ImageColor
 except Exception as e:
     raise RuntimeError(f"Can't load pillow: {e}\nDo 'pip3 install pillow'.")
 
+from . import cards, masks
+from .cache import LRUCache
+from .credits import CreditBatcher
+from .daemon import DaemonUnavailable, RenderClient
+from .eligibility import MessageFilter
+from .events import ExpQueue
+from .ledger import ExpLedger
+from .encoding import CARD_FORMATS, encode_card, benchmark
+from .palette import dominant_colors
+from .render import (
+    ASSET_CONNECTIONS_PER_HOST,
+    ASSET_MAX_BYTES,
+    ASSET_MAX_PIXELS,
+    ASSET_TIMEOUT,
+    CardRenderer,
+    fetch_asset,
+    fetch_assets,
+    layers_size,
+    open_asset,
+)
+from .reconcile import RoleSync
+from .rewards import build_rewards, roles_after
+from .scheduler import RenderScheduler
+from .timing import RenderTimings
+from .warmer import CardWarmer
+
 from redbot.core import Config
 
 try:
@@ -52,6 +70,31 @@ except Exception as e:
 
 log = logging.getLogger("red.fixator10-cogs.leveler")
 
+# header is read until image size is known, EXIF, ICC profiles and
+# thumbnails of JPEG come before it
+IMAGE_PROBE_BYTES = 256 * 1024
+IMAGE_PROBE_CHUNK = 16 * 1024
+
+# thumbnail size of every background type in contact sheet
+SHEET_THUMBNAILS = {"profile": (170, 152), "rank": (195, 50), "levelup": (176, 67)}
+SHEET_COLUMNS = 4
+
+# sent cards are reused from their attachments, until urls may expire
+ATTACHMENT_TTL = 60 * 60  # seconds
+
+RENDER_WORKERS = 2
+LEVELUP_DEADLINE = 30  # seconds in queue before level-up card is dropped
+WARM_BUDGET = 30  # cards rendered in advance per minute
+
+# messages that may give exp are processed by workers, one per shard of guilds
+EXP_SHARDS = 4
+EXP_QUEUE_SIZE = 500  # events per shard, newer ones are dropped while full
+CREDITS_INTERVAL = 10 * 60  # seconds between deposits of message credits
+ROLE_SYNC_PROGRESS = 10  # seconds between progress updates of role sync
+
+# last writes of unloaded cogs, kept until they are done
+_closing = set()
+
 
 # noinspection PyUnusedLocal
 async def non_global_bank(ctx):
@@ -74,6 +117,12 @@ class Leveler(commands.Cog):
             "bg_price": 0,
             "badge_type": "circles",
             "mention": True,
+            "card_format": "png",
+            "png_compress_level": 6,
+            "png_quantize": False,
+            "warm_cards": False,
+            "render_socket": None,
+            "exp_ledger": False,
             "backgrounds": {
                 "profile": {
                     "alice": "http://i.imgur.com/MUSuMao.png",
@@ -107,13 +156,68 @@ class Leveler(commands.Cog):
             "lvl_msg_lock": None,
             "msg_credits": 0,
             "ignored_channels": [],
+            "role_sync_checkpoint": None,  # last user id done by stopped role sync
         }
         self.config.register_global(**default_global)
         self.config.register_guild(**default_guild)
-        self.session = aiohttp.ClientSession(loop=self.bot.loop)
+        self.session = aiohttp.ClientSession(
+            loop=self.bot.loop,
+            connector=aiohttp.TCPConnector(
+                limit_per_host=ASSET_CONNECTIONS_PER_HOST, loop=self.bot.loop
+            ),
+        )
+        # finished cards, keyed by hash of everything they are rendered from
+        self._card_cache = LRUCache(32 * 1024 * 1024)
+        # static parts of cards, only dynamic values are drawn over them
+        self._layer_cache = LRUCache(64 * 1024 * 1024, sizeof=layers_size)
+        self._local_renderer = CardRenderer(
+            str(bundled_data_path(self)), self.session, self._layer_cache
+        )
+        self._daemon = None  # RenderClient, if render daemon is set
+        self._renderer = RenderScheduler(self.bot.loop, RENDER_WORKERS)
+        self._warmer = CardWarmer(self._renderer, WARM_BUDGET)
+        self._timings = RenderTimings()
+        # background url -> its colors, most abundant first
+        self._palette_cache = LRUCache(256, sizeof=lambda colors: 1)
+        # image url -> whether it's a valid image
+        self._url_verdicts = LRUCache(1024, sizeof=lambda verdict: 1)
+        # hash of sent card -> (url of its attachment, upload time)
+        self._attachment_urls = LRUCache(1024, sizeof=lambda uploaded: 1)
+        # skips messages that can't give exp without touching database
+        self._message_filter = MessageFilter(self._message_filter_guild)
+        self._exp_queue = ExpQueue(
+            self.bot.loop, self._process_message, EXP_SHARDS, EXP_QUEUE_SIZE
+        )
+        self._credits = CreditBatcher(self.bot.loop, CREDITS_INTERVAL)
+        # guild id -> level -> roles and badges given for it
+        self._rewards = {}
+        # guild id -> (RoleSync, its task)
+        self._role_syncs = {}
+        # written only while enabled
+        self._ledger = ExpLedger(self.bot.loop, db)
+        self.bot.loop.create_task(self._create_indexes())
+
+    async def _create_indexes(self):
+        # users are created by upsert, it makes one document per user only
+        # with unique index
+        try:
+            await self._run_db(db.users.create_index, "user_id", unique=True)
+        except pymongo.errors.PyMongoError as e:
+            log.error(f"Unable to create unique index of user ids: {e}")
 
-    def __unload(self):
+    def cog_unload(self):
         self.session.detach()
+        for _sync, task in self._role_syncs.values():
+            task.cancel()
+        self._exp_queue.close()
+        # cogs are unloaded before bot disconnects on shutdown,
+        # so pending credits and ledger events are written meanwhile
+        for close in (self._credits.close(), self._ledger.close()):
+            flush = self.bot.loop.create_task(close)
+            _closing.add(flush)
+            flush.add_done_callback(_closing.discard)
+        self._warmer.close()
+        self._renderer.close()
 
     @commands.cooldown(1, 10, commands.BucketType.user)
     @commands.command(name="profile")
@@ -144,11 +248,15 @@ class Leveler(commands.Cog):
             await channel.send(embed=em)
         else:
             async with ctx.channel.typing():
-                profile = await self.draw_profile(user, server)
-                file = discord.File(profile, filename="profile.png")
-                await channel.send(
+                profile = await self._renderer.render(
+                    ("profile", user.id, server.id),
+                    partial(self.draw_profile, user, server),
+                )
+                await self._send_card(
+                    channel,
+                    "profile",
+                    profile,
                     "**User profile for {}**".format(await self._is_mention(user)),
-                    file=file,
                 )
             db.users.update_one(
                 {"user_id": str(user.id)},
@@ -219,13 +327,16 @@ class Leveler(commands.Cog):
             await channel.send(embed=em)
         else:
             async with channel.typing():
-                rank = await self.draw_rank(user, server)
-                file = discord.File(rank, filename="rank.png")
-                await channel.send(
+                rank = await self._renderer.render(
+                    ("rank", user.id, server.id), partial(self.draw_rank, user, server)
+                )
+                await self._send_card(
+                    channel,
+                    "rank",
+                    rank,
                     "**Ranking & Statistics for {}**".format(
                         await self._is_mention(user)
                     ),
-                    file=file,
                 )
             db.users.update_one(
                 {"user_id": str(user.id)},
@@ -429,6 +540,7 @@ class Leveler(commands.Cog):
             db.users.update_one(
                 {"user_id": str(user.id)}, {"$set": {"rep": userinfo["rep"] + 1}}
             )
+            self._invalidate_cards(user.id)
             await ctx.send(
                 "**You have just given {} a reputation point!**".format(
                     await self._is_mention(user)
@@ -607,6 +719,9 @@ class Leveler(commands.Cog):
             hex_colors = await self._auto_color(
                 ctx, userinfo["profile_background"], color_ranks
             )
+            if hex_colors is None:
+                await ctx.send("**Unable to get colors from your background.**")
+                return
             set_color = []
             for hex_color in hex_colors:
                 color_temp = self._hex_to_rgb(hex_color, default_a)
@@ -673,11 +788,13 @@ class Leveler(commands.Cog):
                         }
                     },
                 )
+            self._invalidate_layers(user.id)
             await ctx.send("**Colors for profile set.**")
         else:
             db.users.update_one(
                 {"user_id": str(user.id)}, {"$set": {section_name: set_color[0]}}
             )
+            self._invalidate_layers(user.id)
             await ctx.send("**Color for profile {} set.**".format(section))
 
     @rankset.command(name="color")
@@ -731,6 +848,9 @@ class Leveler(commands.Cog):
             hex_colors = await self._auto_color(
                 ctx, userinfo["rank_background"], color_ranks
             )
+            if hex_colors is None:
+                await ctx.send("**Unable to get colors from your background.**")
+                return
             set_color = []
             for hex_color in hex_colors:
                 color_temp = self._hex_to_rgb(hex_color, default_a)
@@ -786,11 +906,13 @@ class Leveler(commands.Cog):
                         }
                     },
                 )
+            self._invalidate_layers(user.id)
             await ctx.send("**Colors for rank set.**")
         else:
             db.users.update_one(
                 {"user_id": str(user.id)}, {"$set": {section_name: set_color[0]}}
             )
+            self._invalidate_layers(user.id)
             await ctx.send("**Color for rank {} set.**".format(section))
 
     @levelupset.command(name="color")
@@ -832,6 +954,9 @@ class Leveler(commands.Cog):
             hex_colors = await self._auto_color(
                 ctx, userinfo["levelup_background"], color_ranks
             )
+            if hex_colors is None:
+                await ctx.send("**Unable to get colors from your background.**")
+                return
             set_color = []
             for hex_color in hex_colors:
                 color_temp = self._hex_to_rgb(hex_color, default_a)
@@ -850,44 +975,28 @@ class Leveler(commands.Cog):
         db.users.update_one(
             {"user_id": str(user.id)}, {"$set": {section_name: set_color[0]}}
         )
+        self._invalidate_layers(user.id)
         await ctx.send("**Color for level-up {} set.**".format(section))
 
     # uses k-means algorithm to find color from bg, rank is abundance of color, descending
     async def _auto_color(self, ctx, url: str, ranks):
         phrases = ["Calculating colors..."]  # in case I want more
         await ctx.send("**{}**".format(random.choice(phrases)))
-        clusters = 10
-
-        async with self.session.get(url) as r:
-            image = await r.content.read()
-        image = BytesIO(image)
-
-        im = Image.open(image).convert("RGBA")
-        im = im.resize((290, 290))  # resized to reduce time
-        ar = scipy.misc.fromimage(im)
-        shape = ar.shape
-        ar = ar.reshape(scipy.product(shape[:2]), shape[2])
-
-        codes, dist = scipy.cluster.vq.kmeans(ar.astype(float), clusters)
-        vecs, dist = scipy.cluster.vq.vq(ar, codes)  # assign codes
-        counts, bins = scipy.histogram(vecs, len(codes))  # count occurrences
-
-        # sort counts
-        freq_index = []
-        index = 0
-        for count in counts:
-            freq_index.append((index, count))
-            index += 1
-        sorted_list = sorted(freq_index, key=operator.itemgetter(1), reverse=True)
-
-        colors = []
-        for rank in ranks:
-            color_index = min(rank, len(codes))
-            peak = codes[sorted_list[color_index][0]]  # gets the original index
-            peak = peak.astype(int)
-
-            colors.append("".join(format(c, "02x") for c in peak))
-        return colors  # returns array
+
+        palette = self._palette_cache.get(url)
+        if palette is None:
+            image = await fetch_asset(self.session, url)
+            if image is None:
+                return None
+            try:
+                palette = await self.bot.loop.run_in_executor(
+                    None, dominant_colors, image
+                )
+            except IOError:
+                return None
+            self._palette_cache.set(url, palette)
+
+        return [palette[min(rank, len(palette) - 1)] for rank in ranks]
 
     # converts hex to rgb
     def _hex_to_rgb(self, hex_num: str, a: int):
@@ -931,6 +1040,7 @@ class Leveler(commands.Cog):
 
         if len(info) < max_char:
             db.users.update_one({"user_id": str(user.id)}, {"$set": {"info": info}})
+            self._invalidate_layers(user.id)
             await ctx.send("**Your info section has been succesfully set!**")
         else:
             await ctx.send(
@@ -967,6 +1077,7 @@ class Leveler(commands.Cog):
                         }
                     },
                 )
+                self._invalidate_layers(user.id)
                 await ctx.send(
                     "**Your new level-up background has been succesfully set!**"
                 )
@@ -1003,6 +1114,7 @@ class Leveler(commands.Cog):
                         }
                     },
                 )
+                self._invalidate_layers(user.id)
                 await ctx.send(
                     "**Your new profile background has been succesfully set!**"
                 )
@@ -1035,6 +1147,7 @@ class Leveler(commands.Cog):
                     {"user_id": str(user.id)},
                     {"$set": {"rank_background": backgrounds["rank"][image_name]}},
                 )
+                self._invalidate_layers(user.id)
                 await ctx.send("**Your new rank background has been succesfully set!**")
         else:
             await ctx.send(
@@ -1059,6 +1172,7 @@ class Leveler(commands.Cog):
         if len(title) < max_char:
             userinfo["title"] = title
             db.users.update_one({"user_id": str(user.id)}, {"$set": {"title": title}})
+            self._invalidate_layers(user.id)
             await ctx.send("**Your title has been succesfully set!**")
         else:
             await ctx.send(
@@ -1155,10 +1269,12 @@ class Leveler(commands.Cog):
         if channel.id in await self.config.guild(server).ignored_channels():
             async with self.config.guild(server).ignored_channels() as channels:
                 channels.remove(channel.id)
+            self._message_filter.forget_guild(server.id)
             await ctx.send(f"**Messages in {channel.mention} will give exp now**")
         else:
             async with self.config.guild(server).ignored_channels() as channels:
                 channels.append(channel.id)
+            self._message_filter.forget_guild(server.id)
             await ctx.send(f"**Messages in {channel.mention} will not give exp now**")
 
     @lvladmin.command(name="lock")
@@ -1209,7 +1325,7 @@ class Leveler(commands.Cog):
     async def _give_chat_credit(self, user, server):
         msg_credits = await self.config.guild(server).msg_credits()
         if msg_credits and not await bank.is_global():
-            await bank.deposit_credits(user, msg_credits)
+            self._credits.add(user, msg_credits)
 
     @checks.is_owner()
     @lvladmin.command()
@@ -1248,8 +1364,8 @@ class Leveler(commands.Cog):
         old_server_exp = 0
         for i in range(userinfo["servers"][str(server.id)]["level"]):
             old_server_exp += await self._required_exp(i)
+        old_server_exp += userinfo["servers"][str(server.id)]["current_exp"]
         userinfo["total_exp"] -= old_server_exp
-        userinfo["total_exp"] -= userinfo["servers"][str(server.id)]["current_exp"]
 
         # add in new exp
         total_exp = await self._level_exp(level)
@@ -1267,6 +1383,8 @@ class Leveler(commands.Cog):
                 }
             },
         )
+        await self._record_exp(server, user, total_exp - old_server_exp)
+        self._invalidate_cards(user.id)
         await ctx.send(
             "**{}'s Level has been set to `{}`.**".format(
                 await self._is_mention(user), level
@@ -1286,16 +1404,278 @@ class Leveler(commands.Cog):
             await self.config.mention.set(True)
             await ctx.send("**Mentions enabled.**")
 
+    @checks.is_owner()
+    @lvladmin.command()
+    async def warmcards(self, ctx):
+        """Toggle rendering rank cards in advance.
+
+        Rank cards of users who gain exp are rendered while bot is idle,
+        so `rank` command is answered from cache."""
+        if await self.config.warm_cards():
+            await self.config.warm_cards.set(False)
+            await ctx.send("**Rank cards will be rendered on request only.**")
+        else:
+            await self.config.warm_cards.set(True)
+            await ctx.send("**Rank cards will be rendered in advance.**")
+
+    @checks.is_owner()
+    @lvladmin.command()
+    async def cachestats(self, ctx):
+        """Show usage of rendered card caches."""
+        msg = "Cards: {}\n".format(self._card_cache.stats())
+        msg += "Static layers: {}\n".format(self._layer_cache.stats())
+        await ctx.send(box(msg))
+
+    @checks.is_owner()
+    @lvladmin.command()
+    async def renderstats(self, ctx):
+        """Show render queue depth and wait times."""
+        msg = f"{self._renderer.stats()}\n{self._warmer.stats()}"
+        if self._daemon is not None:
+            msg += f"\n{self._daemon.stats()}"
+        await ctx.send(box(msg))
+
+    @checks.is_owner()
+    @lvladmin.command()
+    async def messagestats(self, ctx):
+        """Show how many messages were skipped and queued for exp."""
+        msg = (
+            f"{self._message_filter.stats()}\n{self._exp_queue.stats()}\n"
+            f"{self._credits.stats()}\n{self._ledger.stats()}"
+        )
+        await ctx.send(box(msg))
+
+    @checks.is_owner()
+    @lvladmin.command()
+    async def renderdaemon(self, ctx, socket_path: str = None):
+        """Render cards in render daemon listening on Unix socket.
+
+        Start it with `python -m leveler.daemon --socket <path>`, from the folder
+        this cog is installed in. Without path, cards are rendered by the bot.
+        Cards are rendered by the bot while daemon is unavailable."""
+        await self.config.render_socket.set(socket_path)
+        if socket_path is None:
+            self._daemon = None
+            await ctx.send("**Cards will be rendered by the bot.**")
+        else:
+            await ctx.send(f"**Cards will be rendered by daemon at `{socket_path}`.**")
+
+    @checks.is_owner()
+    @lvladmin.command()
+    async def expledger(self, ctx):
+        """Toggle log of exp changes, that exp of users can be rebuilt from.
+
+        Log starts from current exp of every user."""
+        if await self.config.exp_ledger():
+            await self.config.exp_ledger.set(False)
+            await ctx.send("**Exp ledger disabled.**")
+            return
+        totals = []
+        for userinfo in db.users.find({}):
+            server_total = 0
+            for server_id, server in userinfo.get("servers", {}).items():
+                try:
+                    exp = await self._level_exp(server["level"]) + server["current_exp"]
+                except KeyError:
+                    continue
+                totals.append((server_id, userinfo["user_id"], exp))
+                server_total += exp
+            # exp not counted in any server, so totals are rebuilt as they are
+            rest = userinfo.get("total_exp", 0) - server_total
+            if rest:
+                totals.append(("", userinfo["user_id"], rest))
+        count = await self._ledger.start(totals)
+        await self.config.exp_ledger.set(True)
+        await ctx.send(f"**Exp ledger enabled, started from {count} exp totals.**")
+
+    @checks.is_owner()
+    @lvladmin.command()
+    async def rebuildexp(self, ctx):
+        """Rebuild levels and exp of all users from exp ledger."""
+        if not await self.config.exp_ledger():
+            await ctx.send("**Exp ledger is disabled.**")
+            return
+        await ctx.send(
+            "**Levels and exp of all users will be replaced by ones from exp ledger. "
+            "Continue? (y/n)**"
+        )
+        pred = MessagePredicate.yes_or_no(ctx)
+        try:
+            await self.bot.wait_for("message", timeout=15, check=pred)
+        except AsyncTimeoutError:
+            pass
+        if not pred.result:
+            await ctx.send("**Rebuild canceled.**")
+            return
+        users = 0
+        async with ctx.typing():
+            await self._ledger.compact()
+            for user_id, servers in self._ledger.users():
+                update = {"total_exp": sum(servers.values())}
+                for server_id, exp in servers.items():
+                    if not server_id:
+                        continue
+                    level = await self._level_for_exp(exp)
+                    update["servers.{}.level".format(server_id)] = level
+                    update["servers.{}.current_exp".format(server_id)] = (
+                        exp - await self._level_exp(level)
+                    )
+                db.users.update_one({"user_id": user_id}, {"$set": update})
+                users += 1
+        self._card_cache.clear()
+        await ctx.send(f"**Exp of {users} users rebuilt.** {self._ledger.stats()}")
+
+    @checks.is_owner()
+    @lvladmin.command()
+    async def rendertimes(self, ctx, card: str = None):
+        """Show time spent in every stage of card rendering, in ms.
+
+        With card type (profile, rank or levelup), shows histogram of its stages."""
+        if card is None:
+            msg = self._timings.summary()
+        elif card.lower() in ("profile", "rank", "levelup"):
+            msg = "{}\n\n{}".format(
+                self._timings.summary(card.lower()),
+                self._timings.histogram(card.lower()),
+            )
+        else:
+            await ctx.send("**Invalid card type. (profile, rank, levelup)**")
+            return
+        for page in pagify(msg, shorten_by=10):
+            await ctx.send(box(page))
+
+    @checks.is_owner()
+    @lvladmin.group()
+    async def encoding(self, ctx):
+        """Output format of rendered cards"""
+        pass
+
+    @encoding.command(name="format")
+    async def encoding_format(self, ctx, card_format: str):
+        """Set output format of cards.
+
+        png or webp (lossless)"""
+        card_format = card_format.lower()
+        if card_format not in CARD_FORMATS:
+            await ctx.send("**That is not a valid format! (png, webp)**")
+            return
+        await self.config.card_format.set(card_format)
+        self._card_cache.clear()
+        await ctx.send(f"**Cards will be sent as `{card_format}` now.**")
+
+    @encoding.command(name="compression")
+    async def encoding_compression(self, ctx, level: int):
+        """Set zlib compression level of png cards.
+
+        0 (fastest, biggest) - 9 (slowest, smallest). Default = 6"""
+        if level < 0 or level > 9:
+            await ctx.send("**Please enter a valid number (0 - 9)**")
+            return
+        await self.config.png_compress_level.set(level)
+        self._card_cache.clear()
+        await ctx.send(f"**Png compression level set to `{level}`.**")
+
+    @encoding.command(name="quantize")
+    async def encoding_quantize(self, ctx):
+        """Toggle 256 colors palette for png cards."""
+        quantize = not await self.config.png_quantize()
+        await self.config.png_quantize.set(quantize)
+        self._card_cache.clear()
+        if quantize:
+            await ctx.send("**Png cards will be quantized to 256 colors.**")
+        else:
+            await ctx.send("**Png cards will keep all colors.**")
+
+    @encoding.command(name="benchmark")
+    @commands.guild_only()
+    async def encoding_benchmark(self, ctx, rounds: int = 5):
+        """Compare encode time and size of every output mode on your cards."""
+        user = ctx.author
+        server = ctx.guild
+        if not 0 < rounds <= 50:
+            await ctx.send("**Please enter a valid number of rounds (1 - 50)**")
+            return
+        await self._create_user(user, server)
+        async with ctx.channel.typing():
+            images = {
+                "profile": await self.draw_profile(user, server),
+                "rank": await self.draw_rank(user, server),
+                "levelup": await self.draw_levelup(user, server),
+            }
+            images = {
+                name: Image.open(BytesIO(image)).convert("RGBA")
+                for name, image in images.items()
+            }
+            results = await self.bot.loop.run_in_executor(
+                None, partial(benchmark, images, rounds)
+            )
+        msg = "{:<8} {:<25} {:>7} {:>7}\n".format("Card", "Mode", "ms", "KiB")
+        for name, label, elapsed, size in results:
+            msg += "{:<8} {:<25} {:>7.2f} {:>7.1f}\n".format(
+                name, label, elapsed, size / 1024
+            )
+        for page in pagify(msg):
+            await ctx.send(box(page))
+
     async def _valid_image_url(self, url):
+        verdict = self._url_verdicts.get(url)
+        if verdict is None:
+            verdict = await self._probe_image_url(url)
+            # unreachable urls are checked again next time
+            if verdict is not None:
+                self._url_verdicts.set(url, verdict)
+        return bool(verdict)
+
+    async def _probe_image_url(self, url):
+        """Check image by its size and header, without downloading or decoding it.
+
+        None if url can't be reached, or header is longer than IMAGE_PROBE_BYTES."""
+        try:
+            async with self.session.get(
+                str(url),
+                headers={"Range": f"bytes=0-{IMAGE_PROBE_BYTES - 1}"},
+                timeout=aiohttp.ClientTimeout(total=ASSET_TIMEOUT),
+            ) as r:
+                if r.status >= 500:
+                    return None
+                if r.status not in (200, 206):
+                    return False
+                total = r.content_length
+                if r.status == 206:
+                    # Content-Range: bytes 0-32767/123456
+                    total = r.headers.get("Content-Range", "").rpartition("/")[2]
+                    total = int(total) if total.isdigit() else None
+                if total is not None and total > ASSET_MAX_BYTES:
+                    return False
+                head = bytearray()
+                # server may ignore Range, so stop reading after the header
+                async for chunk in r.content.iter_chunked(IMAGE_PROBE_CHUNK):
+                    head.extend(chunk)
+                    verdict = self._check_image_header(head)
+                    if verdict is not None:
+                        return verdict
+                    if len(head) >= IMAGE_PROBE_BYTES:
+                        return None
+        except (aiohttp.ClientError, AsyncTimeoutError, ValueError) as e:
+            log.debug(f"Unable to check {url}: {e}")
+            return None
+        # whole file is read, and it's not an image
+        return False
 
+    @staticmethod
+    def _check_image_header(head):
+        """Whether image size is fine, None if header is not complete yet."""
         try:
-            async with self.session.get(url) as r:
-                image = await r.content.read()
-            image = BytesIO(image)
-            Image.open(image).convert("RGBA")
-            return True
-        except IOError:
+            # lazy, reads only header
+            image = Image.open(BytesIO(head))
+            # same check as in _open_asset, for the biggest image of cards
+            image.draft("RGB", (340, 340))
+        except Image.DecompressionBombError:
             return False
+        except IOError:
+            # truncated header can't be told apart from other data
+            return None
+        return image.width * image.height <= ASSET_MAX_PIXELS
 
     @checks.admin_or_permissions(manage_guild=True)
     @lvladmin.command()
@@ -1309,6 +1689,7 @@ class Leveler(commands.Cog):
         else:
             await self.config.guild(server).disabled.set(True)
             await ctx.send("**Leveler disabled on `{}`.**".format(server.name))
+        self._message_filter.forget_guild(server.id)
 
     @checks.admin_or_permissions(manage_guild=True)
     @lvladmin.command()
@@ -1477,7 +1858,7 @@ class Leveler(commands.Cog):
     async def buy(self, ctx, name: str, global_badge: str = None):
         """Get a badge from repository.
 
-        optional = "-global\""""
+        optional = "-global\" """
         user = ctx.author
         server = ctx.guild
         if global_badge == "-global":
@@ -1500,13 +1881,14 @@ class Leveler(commands.Cog):
                             "**That badge is not purchasable.**".format(name)
                         )
                     elif badge_info["price"] == 0:
-                        userinfo["badges"][
-                            "{}_{}".format(name, str(serverid))
-                        ] = server_badges[name]
+                        userinfo["badges"]["{}_{}".format(name, str(serverid))] = (
+                            server_badges[name]
+                        )
                         db.users.update_one(
                             {"user_id": userinfo["user_id"]},
                             {"$set": {"badges": userinfo["badges"]}},
                         )
+                        self._invalidate_layers(user.id)
                         await ctx.send("**`{}` has been obtained.**".format(name))
                     else:
                         await ctx.send(
@@ -1524,13 +1906,14 @@ class Leveler(commands.Cog):
                             return
                         if badge_info["price"] <= await bank.get_balance(user):
                             await bank.withdraw_credits(user, badge_info["price"])
-                            userinfo["badges"][
-                                "{}_{}".format(name, str(serverid))
-                            ] = server_badges[name]
+                            userinfo["badges"]["{}_{}".format(name, str(serverid))] = (
+                                server_badges[name]
+                            )
                             db.users.update_one(
                                 {"user_id": userinfo["user_id"]},
                                 {"$set": {"badges": userinfo["badges"]}},
                             )
+                            self._invalidate_layers(user.id)
                             await ctx.send(
                                 "**You have bought the `{}` badge for `{}`.**".format(
                                     name, badge_info["price"]
@@ -1583,6 +1966,7 @@ class Leveler(commands.Cog):
                     {"user_id": userinfo["user_id"]},
                     {"$set": {"badges": userinfo["badges"]}},
                 )
+                self._invalidate_layers(user.id)
                 await ctx.send(
                     "**The `{}` badge priority has been set to `{}`!**".format(
                         userinfo["badges"][badge]["badge_name"], priority_num
@@ -1614,7 +1998,8 @@ class Leveler(commands.Cog):
     ):
         """Add a badge.
 
-        name = "Use Quotes", Colors = #hex. bg_img = url, price = -1(non-purchasable), 0,..."""
+        name = "Use Quotes", Colors = #hex. bg_img = url, price = -1(non-purchasable), 0,...
+        """
 
         user = ctx.author
         server = ctx.guild
@@ -1683,6 +2068,7 @@ class Leveler(commands.Cog):
             db.badges.update_one(
                 {"server_id": str(serverid)}, {"$set": {"badges": badges["badges"]}}
             )
+            self._rewards.pop(server.id, None)
             await ctx.send(
                 "**`{}` Badge added in `{}` server.**".format(name, servername)
             )
@@ -1692,6 +2078,7 @@ class Leveler(commands.Cog):
             db.badges.update_one(
                 {"server_id": serverid}, {"$set": {"badges": badges["badges"]}}
             )
+            self._rewards.pop(server.id, None)
 
             # go though all users and update the badge.
             # Doing it this way because dynamic does more accesses when doing profile
@@ -1702,11 +2089,9 @@ class Leveler(commands.Cog):
                     badge_name = "{}_{}".format(name, serverid)
                     if badge_name in userbadges.keys():
                         user_priority_num = userbadges[badge_name]["priority_num"]
-                        new_badge[
-                            "priority_num"
-                        ] = (
-                            user_priority_num
-                        )  # maintain old priority number set by user
+                        new_badge["priority_num"] = (
+                            user_priority_num  # maintain old priority number set by user
+                        )
                         userbadges[badge_name] = new_badge
                         db.users.update_one(
                             {"user_id": user["user_id"]},
@@ -1716,6 +2101,8 @@ class Leveler(commands.Cog):
                     log.error(
                         f"Unable to update badge {name} for {user['user_id']}: {exc}"
                     )
+            self._layer_cache.clear()
+            self._card_cache.clear()
             await ctx.send("**The `{}` badge has been updated**".format(name))
 
     @checks.is_owner()
@@ -1768,6 +2155,7 @@ class Leveler(commands.Cog):
                 {"server_id": serverbadges["server_id"]},
                 {"$set": {"badges": serverbadges["badges"]}},
             )
+            self._rewards.pop(server.id, None)
             # remove the badge if there
             for user_info_temp in db.users.find({}):
                 try:
@@ -1785,6 +2173,8 @@ class Leveler(commands.Cog):
                         f"Unable to delete badge {name} from {user_info_temp['user_id']}: {exc}"
                     )
 
+            self._layer_cache.clear()
+            self._card_cache.clear()
             await ctx.send("**The `{}` badge has been removed.**".format(name))
         else:
             await ctx.send("**That badge does not exist.**")
@@ -1824,6 +2214,7 @@ class Leveler(commands.Cog):
         db.users.update_one(
             {"user_id": str(user.id)}, {"$set": {"badges": userinfo["badges"]}}
         )
+        self._invalidate_layers(user.id)
         await ctx.send(
             "**{} has just given `{}` the `{}` badge!**".format(
                 await self._is_mention(org_user), await self._is_mention(user), name
@@ -1865,6 +2256,7 @@ class Leveler(commands.Cog):
                 db.users.update_one(
                     {"user_id": str(user.id)}, {"$set": {"badges": userinfo["badges"]}}
                 )
+                self._invalidate_layers(user.id)
                 await ctx.send(
                     "**{} has taken the `{}` badge from {}! :upside_down:**".format(
                         await self._is_mention(org_user),
@@ -1905,6 +2297,7 @@ class Leveler(commands.Cog):
                 {"server_id": str(server.id)},
                 {"$set": {"badges": server_linked_badges["badges"]}},
             )
+        self._rewards.pop(server.id, None)
         await ctx.send(
             "**The `{}` badge has been linked to level `{}`**".format(badge_name, level)
         )
@@ -1929,6 +2322,7 @@ class Leveler(commands.Cog):
             db.badgelinks.update_one(
                 {"server_id": str(server.id)}, {"$set": {"badges": badge_links}}
             )
+            self._rewards.pop(server.id, None)
         else:
             await ctx.send(
                 "**The `{}` badge is not linked to any levels!**".format(badge_name)
@@ -2014,6 +2408,7 @@ class Leveler(commands.Cog):
                     {"server_id": str(server.id)},
                     {"$set": {"roles": server_roles["roles"]}},
                 )
+            self._rewards.pop(server.id, None)
 
             if remove_role is None:
                 await ctx.send(
@@ -2028,6 +2423,10 @@ class Leveler(commands.Cog):
                         role_name, level, remove_role
                     )
                 )
+            await ctx.send(
+                f"Members that already reached it get it with "
+                f"`{ctx.prefix}lvladmin role sync`."
+            )
 
     @checks.mod_or_permissions(manage_roles=True)
     @role.command(name="unlink")
@@ -2049,11 +2448,73 @@ class Leveler(commands.Cog):
             db.roles.update_one(
                 {"server_id": str(server.id)}, {"$set": {"roles": roles}}
             )
+            self._rewards.pop(server.id, None)
         else:
             await ctx.send(
                 "**The `{}` role is not linked to any levels!**".format(role_name)
             )
 
+    @checks.admin_or_permissions(manage_roles=True)
+    @role.command(name="sync")
+    @commands.guild_only()
+    async def syncroles(self, ctx, restart: bool = False):
+        """Give linked roles to members that already reached their levels.
+
+        Stopped sync continues where it was, unless `restart` is given."""
+        server = ctx.guild
+        if server.id in self._role_syncs:
+            sync, _task = self._role_syncs[server.id]
+            await ctx.send(f"**Role sync is already running:** {sync.progress()}")
+            return
+        checkpoint = (
+            None if restart else await self.config.guild(server).role_sync_checkpoint()
+        )
+        sync = RoleSync(
+            server,
+            db.users,
+            partial(self._level_rewards, server),
+            self.config.guild(server).role_sync_checkpoint.set,
+            checkpoint,
+        )
+        task = self.bot.loop.create_task(sync.run())
+        self._role_syncs[server.id] = (sync, task)
+        try:
+            progress = await ctx.send(f"**Syncing roles:** {sync.progress()}")
+            while not task.done():
+                await wait([task], timeout=ROLE_SYNC_PROGRESS)
+                try:
+                    await progress.edit(content=f"**Syncing roles:** {sync.progress()}")
+                except discord.HTTPException:
+                    pass  # progress message may be deleted, sync goes on
+        finally:
+            # sync isn't left running where syncstop can't reach it
+            task.cancel()
+            self._role_syncs.pop(server.id, None)
+        if task.cancelled():
+            await ctx.send(
+                f"**Role sync stopped:** {sync.progress()}\n"
+                f"Use `{ctx.prefix}lvladmin role sync` to continue it."
+            )
+        elif isinstance(task.exception(), discord.Forbidden):
+            await ctx.send("**Role sync stopped: Missing Permissions.**")
+        elif task.exception() is not None:
+            log.error("Role sync failed", exc_info=task.exception())
+            await ctx.send(f"**Role sync failed:** {task.exception()}")
+        else:
+            await ctx.send(f"**Roles synced:** {sync.progress()}")
+
+    @checks.admin_or_permissions(manage_roles=True)
+    @role.command(name="syncstop")
+    @commands.guild_only()
+    async def stopsyncroles(self, ctx):
+        """Stop role sync, it can be continued later."""
+        if ctx.guild.id not in self._role_syncs:
+            await ctx.send("**Role sync is not running.**")
+            return
+        _sync, task = self._role_syncs[ctx.guild.id]
+        task.cancel()
+        await ctx.send("**Stopping role sync.**")
+
     @checks.mod_or_permissions(manage_roles=True)
     @role.command(name="listlinks")
     @commands.guild_only()
@@ -2100,8 +2561,8 @@ class Leveler(commands.Cog):
     @lvladminbg.command()
     @commands.guild_only()
     async def addprofilebg(self, ctx, name: str, url: str):
-        """Add a profile background. 
-        
+        """Add a profile background.
+
         Proportions: (290px x 290px)"""
         backgrounds = await self.config.backgrounds()
         if name in backgrounds["profile"].keys():
@@ -2175,6 +2636,7 @@ class Leveler(commands.Cog):
             {"user_id": str(user_id)},
             {"$set": {"{}_background".format(type_input): img_url}},
         )
+        self._invalidate_layers(user_id)
         await ctx.send("**User {} custom {} background set.**".format(user_id, bg_type))
 
     @checks.is_owner()
@@ -2221,10 +2683,11 @@ class Leveler(commands.Cog):
 
     @commands.command(name="backgrounds")
     @commands.guild_only()
-    async def disp_backgrounds(self, ctx, bg_type):
+    async def disp_backgrounds(self, ctx, bg_type, display: str = "list"):
         """Gives a list of backgrounds.
 
-        [p]backgrounds [profile|rank|levelup]"""
+        [p]backgrounds [profile|rank|levelup] [list|sheet]
+        `sheet` shows all backgrounds on one image."""
         server = ctx.guild
         backgrounds = await self.config.backgrounds()
 
@@ -2254,7 +2717,21 @@ class Leveler(commands.Cog):
         else:
             bg_key = None
 
-        if bg_key:
+        if bg_key and display.lower() == "sheet":
+            if not backgrounds[bg_key]:
+                await ctx.send("**There are no backgrounds of this type.**")
+                return
+            async with ctx.channel.typing():
+                sheet = await self._renderer.render(
+                    ("sheet", bg_key),
+                    partial(self._contact_sheet, bg_key, backgrounds[bg_key]),
+                )
+            filename = f"backgrounds.{await self.config.card_format()}"
+            em.set_image(url=f"attachment://{filename}")
+            await ctx.send(
+                embed=em, file=discord.File(BytesIO(sheet), filename=filename)
+            )
+        elif bg_key:
             embeds = []
             total = len(backgrounds[bg_key])
             cnt = 1
@@ -2272,45 +2749,108 @@ class Leveler(commands.Cog):
         else:
             await ctx.send("**Invalid Background Type. (profile, rank, levelup)**")
 
+    async def _contact_sheet(self, bg_type, backgrounds):
+        """All backgrounds of type on one image, cached until they are changed.
+
+        Sheet with a background that failed to download isn't cached."""
+        encoding = await self._card_encoding()
+        key = json.dumps(["sheet", bg_type, sorted(backgrounds.items()), encoding])
+        key = hashlib.sha256(key.encode()).hexdigest()
+        sheet = self._card_cache.get(key)
+        if sheet is None:
+            names = sorted(backgrounds)
+            images = await fetch_assets(
+                self.session, *[backgrounds[name] for name in names]
+            )
+            sheet = await self.bot.loop.run_in_executor(
+                None,
+                partial(
+                    self._draw_contact_sheet,
+                    bg_type,
+                    list(zip(names, images)),
+                    encoding,
+                ),
+            )
+            # backgrounds that failed to download are tried again next time
+            if all(image is not None for image in images):
+                self._card_cache.set(key, sheet, tag="backgrounds")
+        return sheet
+
+    def _draw_contact_sheet(self, bg_type, backgrounds, encoding):
+        thumb_width, thumb_height = SHEET_THUMBNAILS[bg_type]
+        padding = 8
+        label_height = 20
+        columns = min(SHEET_COLUMNS, len(backgrounds))
+        rows = math.ceil(len(backgrounds) / columns)
+        sheet = Image.new(
+            "RGB",
+            (
+                padding + columns * (thumb_width + padding),
+                padding + rows * (thumb_height + label_height + padding),
+            ),
+            (35, 35, 35),
+        )
+        draw = ImageDraw.Draw(sheet)
+        # not cached font, cached ones are used by renderers on the event loop
+        font = ImageFont.truetype(self.font_file, 14)
+
+        for index, (name, image) in enumerate(backgrounds):
+            x = padding + index % columns * (thumb_width + padding)
+            y = padding + index // columns * (thumb_height + label_height + padding)
+            thumbnail = open_asset(
+                image, (60, 60, 60, 255), (thumb_width, thumb_height)
+            )
+            thumbnail = thumbnail.resize((thumb_width, thumb_height), Image.ANTIALIAS)
+            sheet.paste(thumbnail.convert("RGB"), (x, y))
+            while len(name) > 1 and font.getsize(name)[0] > thumb_width:
+                name = name[:-1]
+            draw.text((x, y + thumb_height + 2), name, font=font, fill=(255, 255, 255))
+        return encode_card(sheet, *encoding)
+
     async def draw_profile(self, user, server):
-        font_thin_file = f"{bundled_data_path(self)}/Uni_Sans_Thin.ttf"
-        font_heavy_file = f"{bundled_data_path(self)}/Uni_Sans_Heavy.ttf"
-        font_file = f"{bundled_data_path(self)}/Ubuntu-R_0.ttf"
-        font_bold_file = f"{bundled_data_path(self)}/Ubuntu-B_0.ttf"
-
-        name_fnt = ImageFont.truetype(font_heavy_file, 30)
-        name_u_fnt = ImageFont.truetype(self.font_unicode_file, 30)
-        title_fnt = ImageFont.truetype(font_heavy_file, 22)
-        title_u_fnt = ImageFont.truetype(self.font_unicode_file, 23)
-        label_fnt = ImageFont.truetype(font_bold_file, 18)
-        exp_fnt = ImageFont.truetype(font_bold_file, 13)
-        large_fnt = ImageFont.truetype(font_thin_file, 33)
-        rep_fnt = ImageFont.truetype(font_heavy_file, 26)
-        rep_u_fnt = ImageFont.truetype(self.font_unicode_file, 30)
-        text_fnt = ImageFont.truetype(font_file, 14)
-        text_u_fnt = ImageFont.truetype(self.font_unicode_file, 14)
-        symbol_u_fnt = ImageFont.truetype(self.font_unicode_file, 15)
-
-        async def _write_unicode(text, init_x, y, font, unicode_font, fill):
-            write_pos = init_x
-            check_font = TTFont(font.path)
-
-            for char in text:
-                # if char.isalnum() or char in string.punctuation or char in string.whitespace:
-                if await self.char_in_font(char, check_font):
-                    draw.text((write_pos, y), "{}".format(char), font=font, fill=fill)
-                    write_pos += font.getsize(char)[0]
-                else:
-                    draw.text(
-                        (write_pos, y), "{}".format(char), font=unicode_font, fill=fill
-                    )
-                    write_pos += unicode_font.getsize(char)[0]
+        timer = self._timings.start("profile")
 
         # get urls
         userinfo = db.users.find_one({"user_id": str(user.id)})
         self._badge_convert_dict(userinfo)
         userinfo = db.users.find_one({"user_id": str(user.id)})
         bg_url = userinfo["profile_background"]
+        timer.lap("db")
+
+        global_rank = await self._find_global_rank(user)
+        timer.lap("rank")
+        bank_credits = await bank.get_balance(user)
+        currency = (await bank.get_currency_name(server))[0]
+        badge_type = await self.config.badge_type()
+        encoding = await self._card_encoding()
+        timer.lap("db")
+        card_key = self._card_key(
+            "profile",
+            user,
+            userinfo,
+            [
+                "profile_background",
+                "rep",
+                "rep_color",
+                "badge_col_color",
+                "profile_info_color",
+                "profile_exp_color",
+                "title",
+                "info",
+                "total_exp",
+                "badges",
+            ],
+            global_rank,
+            bank_credits,
+            currency,
+            badge_type,
+            encoding,
+        )
+        cached = self._card_cache.get(card_key)
+        timer.lap("cache")
+        if cached is not None:
+            timer.finish()
+            return cached
 
         # COLORS
         white_color = (240, 240, 240, 255)
@@ -2327,7 +2867,6 @@ class Leveler(commands.Cog):
             info_fill = tuple(userinfo["profile_info_color"])
         else:
             info_fill = (30, 30, 30, 220)
-        info_fill_tx = (info_fill[0], info_fill[1], info_fill[2], 150)
         if (
             "profile_exp_color" not in userinfo.keys()
             or not userinfo["profile_exp_color"]
@@ -2340,206 +2879,28 @@ class Leveler(commands.Cog):
         else:
             level_fill = self._contrast(exp_fill, rep_fill, badge_fill)
 
-        async with self.session.get(bg_url) as r:
-            image = await r.content.read()
-            profile_background = BytesIO(image)
-        async with self.session.get(user.avatar_url) as r:
-            image = await r.content.read()
-            profile_avatar = BytesIO(image)
-
-        bg_image = Image.open(profile_background).convert("RGBA")
-        profile_image = Image.open(profile_avatar).convert("RGBA")
-
-        # set canvas
-        bg_color = (255, 255, 255, 0)
-        result = Image.new("RGBA", (340, 390), bg_color)
-        process = Image.new("RGBA", (340, 390), bg_color)
-
-        # draw
-        draw = ImageDraw.Draw(process)
-
-        # puts in background
-        bg_image = bg_image.resize((340, 340), Image.ANTIALIAS)
-        bg_image = bg_image.crop((0, 0, 340, 305))
-        result.paste(bg_image, (0, 0))
-
-        # draw filter
-        draw.rectangle([(0, 0), (340, 340)], fill=(0, 0, 0, 10))
-
-        draw.rectangle([(0, 134), (340, 325)], fill=info_fill_tx)  # general content
-        # draw profile circle
-        multiplier = 8
-        lvl_circle_dia = 116
-        circle_left = 14
-        circle_top = 48
-        raw_length = lvl_circle_dia * multiplier
-
-        # create mask
-        mask = Image.new("L", (raw_length, raw_length), 0)
-        draw_thumb = ImageDraw.Draw(mask)
-        draw_thumb.ellipse((0, 0) + (raw_length, raw_length), fill=255, outline=0)
-
-        # border
-        lvl_circle = Image.new("RGBA", (raw_length, raw_length))
-        draw_lvl_circle = ImageDraw.Draw(lvl_circle)
-        draw_lvl_circle.ellipse(
-            [0, 0, raw_length, raw_length],
-            fill=(255, 255, 255, 255),
-            outline=(255, 255, 255, 250),
-        )
-        # put border
-        lvl_circle = lvl_circle.resize(
-            (lvl_circle_dia, lvl_circle_dia), Image.ANTIALIAS
-        )
-        lvl_bar_mask = mask.resize((lvl_circle_dia, lvl_circle_dia), Image.ANTIALIAS)
-        process.paste(lvl_circle, (circle_left, circle_top), lvl_bar_mask)
-
-        # put in profile picture
-        total_gap = 6
-        border = int(total_gap / 2)
-        profile_size = lvl_circle_dia - total_gap
-        mask = mask.resize((profile_size, profile_size), Image.ANTIALIAS)
-        profile_image = profile_image.resize(
-            (profile_size, profile_size), Image.ANTIALIAS
-        )
-        process.paste(profile_image, (circle_left + border, circle_top + border), mask)
-
         # write label text
-        white_color = (240, 240, 240, 255)
         light_color = (160, 160, 160, 255)
         dark_color = (35, 35, 35, 255)
-
-        head_align = 140
         # determine info text color
         info_text_color = self._contrast(info_fill, white_color, dark_color)
-        await _write_unicode(
-            (await self._truncate_text(user.name, 22)).upper(),
-            head_align,
-            142,
-            name_fnt,
-            name_u_fnt,
-            info_text_color,
-        )  # NAME
-        await _write_unicode(
-            userinfo["title"].upper(),
-            head_align,
-            170,
-            title_fnt,
-            title_u_fnt,
-            info_text_color,
-        )
-
-        # draw divider
-        draw.rectangle([(0, 323), (340, 324)], fill=(0, 0, 0, 255))  # box
-        # draw text box
-        draw.rectangle(
-            [(0, 324), (340, 390)], fill=(info_fill[0], info_fill[1], info_fill[2], 255)
-        )  # box
-
-        # rep_text = "{} REP".format(userinfo["rep"])
-        rep_text = "{}".format(userinfo["rep"])
-        await _write_unicode("❤", 257, 9, rep_fnt, rep_u_fnt, info_text_color)
-        draw.text(
-            (await self._center(278, 340, rep_text, rep_fnt), 10),
-            rep_text,
-            font=rep_fnt,
-            fill=info_text_color,
-        )  # Exp Text
-
-        label_align = 362  # vertical
-        draw.text(
-            (await self._center(0, 140, "    RANK", label_fnt), label_align),
-            "    RANK",
-            font=label_fnt,
-            fill=info_text_color,
-        )  # Rank
-        draw.text(
-            (await self._center(0, 340, "    LEVEL", label_fnt), label_align),
-            "    LEVEL",
-            font=label_fnt,
-            fill=info_text_color,
-        )  # Exp
-        draw.text(
-            (await self._center(200, 340, "BALANCE", label_fnt), label_align),
-            "BALANCE",
-            font=label_fnt,
-            fill=info_text_color,
-        )  # Credits
-
-        if "linux" in platform.system().lower():
-            global_symbol = "\U0001F30E "
-        else:
-            global_symbol = "G."
-
-        await _write_unicode(
-            global_symbol, 36, label_align + 5, label_fnt, symbol_u_fnt, info_text_color
-        )  # Symbol
-        await _write_unicode(
-            global_symbol,
-            134,
-            label_align + 5,
-            label_fnt,
-            symbol_u_fnt,
-            info_text_color,
-        )  # Symbol
-
-        # userinfo
-        global_rank = "#{}".format(await self._find_global_rank(user))
-        global_level = "{}".format(await self._find_level(userinfo["total_exp"]))
-        draw.text(
-            (await self._center(0, 140, global_rank, large_fnt), label_align - 27),
-            global_rank,
-            font=large_fnt,
-            fill=info_text_color,
-        )  # Rank
-        draw.text(
-            (await self._center(0, 340, global_level, large_fnt), label_align - 27),
-            global_level,
-            font=large_fnt,
-            fill=info_text_color,
-        )  # Exp
-        # draw level bar
-        exp_font_color = self._contrast(exp_fill, light_color, dark_color)
-        exp_frac = int(userinfo["total_exp"] - await self._level_exp(int(global_level)))
-        exp_total = await self._required_exp(int(global_level) + 1)
-        bar_length = int(exp_frac / exp_total * 340)
-        draw.rectangle(
-            [(0, 305), (340, 323)],
-            fill=(level_fill[0], level_fill[1], level_fill[2], 245),
-        )  # level box
-        draw.rectangle(
-            [(0, 305), (bar_length, 323)],
-            fill=(exp_fill[0], exp_fill[1], exp_fill[2], 255),
-        )  # box
-        exp_text = "{}/{}".format(exp_frac, exp_total)  # Exp
-        draw.text(
-            (await self._center(0, 340, exp_text, exp_fnt), 305),
-            exp_text,
-            font=exp_fnt,
-            fill=exp_font_color,
-        )  # Exp Text
-
-        bank_credits = await bank.get_balance(user)
-        credit_txt = f"{bank_credits}{(await bank.get_currency_name(server))[0]}"
-        draw.text(
-            (await self._center(200, 340, credit_txt, large_fnt), label_align - 27),
-            credit_txt,
-            font=large_fnt,
-            fill=info_text_color,
-        )  # Credits
-
-        if not userinfo["title"]:
-            offset = 170
-        else:
-            offset = 195
-        margin = 140
-        txt_color = self._contrast(info_fill, white_color, dark_color)
-        for line in textwrap.wrap(userinfo["info"], width=32):
-            # for line in textwrap.wrap('userinfo["info"]', width=200):
-            # draw.text((margin, offset), line, font=text_fnt, fill=white_color)
-            await _write_unicode(line, margin, offset, text_fnt, text_u_fnt, txt_color)
-            offset += text_fnt.getsize(line)[1] + 2
 
+        base_key = self._card_key(
+            "profile_base",
+            user,
+            userinfo,
+            [
+                "profile_background",
+                "rep_color",
+                "badge_col_color",
+                "profile_info_color",
+                "profile_exp_color",
+                "title",
+                "info",
+                "badges",
+            ],
+            badge_type,
+        )
         # sort badges
         priority_badges = []
 
@@ -2550,140 +2911,55 @@ class Leveler(commands.Cog):
                 priority_badges.append((badge, priority_num))
         sorted_badges = sorted(
             priority_badges, key=operator.itemgetter(1), reverse=True
-        )
-
-        if await self.config.badge_type() == "circles":
-            # circles require antialiasing
-            vert_pos = 172
-            right_shift = 0
-            left = 9 + right_shift
-            size = 38
-            total_gap = 4  # /2
-            hor_gap = 6
-            vert_gap = 6
-            border_width = int(total_gap / 2)
-            multiplier = 6  # for antialiasing
-            raw_length = size * multiplier
-            mult = [
-                (0, 0),
-                (1, 0),
-                (2, 0),
-                (0, 1),
-                (1, 1),
-                (2, 1),
-                (0, 2),
-                (1, 2),
-                (2, 2),
+        )[:9]
+        if badge_type == "circles":
+            badges = [
+                (badge["bg_img"], badge["border_color"]) for badge, _ in sorted_badges
             ]
-            for num in range(9):
-                coord = (
-                    left + int(mult[num][0]) * int(hor_gap + size),
-                    vert_pos + int(mult[num][1]) * int(vert_gap + size),
-                )
-                if num < len(sorted_badges[:9]):
-                    pair = sorted_badges[num]
-                    badge = pair[0]
-                    bg_color = badge["bg_img"]
-                    border_color = badge["border_color"]
-                    # draw mask circle
-                    mask = Image.new("L", (raw_length, raw_length), 0)
-                    draw_thumb = ImageDraw.Draw(mask)
-                    draw_thumb.ellipse(
-                        (0, 0) + (raw_length, raw_length), fill=255, outline=0
-                    )
-
-                    # determine image or color for badge bg
-                    if await self._valid_image_url(bg_color):
-                        # get image
-                        async with self.session.get(bg_color) as r:
-                            image = await r.content.read()
-                        badge = BytesIO(image)
-                        badge_image = Image.open(badge).convert("RGBA")
-                        badge_image = badge_image.resize(
-                            (raw_length, raw_length), Image.ANTIALIAS
-                        )
-
-                        # structured like this because if border = 0, still leaves outline.
-                        if border_color:
-                            square = Image.new(
-                                "RGBA", (raw_length, raw_length), border_color
-                            )
-                            # put border on ellipse/circle
-                            output = ImageOps.fit(
-                                square, (raw_length, raw_length), centering=(0.5, 0.5)
-                            )
-                            output = output.resize((size, size), Image.ANTIALIAS)
-                            outer_mask = mask.resize((size, size), Image.ANTIALIAS)
-                            process.paste(output, coord, outer_mask)
-
-                            # put on ellipse/circle
-                            output = ImageOps.fit(
-                                badge_image,
-                                (raw_length, raw_length),
-                                centering=(0.5, 0.5),
-                            )
-                            output = output.resize(
-                                (size - total_gap, size - total_gap), Image.ANTIALIAS
-                            )
-                            inner_mask = mask.resize(
-                                (size - total_gap, size - total_gap), Image.ANTIALIAS
-                            )
-                            process.paste(
-                                output,
-                                (coord[0] + border_width, coord[1] + border_width),
-                                inner_mask,
-                            )
-                        else:
-                            # put on ellipse/circle
-                            output = ImageOps.fit(
-                                badge_image,
-                                (raw_length, raw_length),
-                                centering=(0.5, 0.5),
-                            )
-                            output = output.resize((size, size), Image.ANTIALIAS)
-                            outer_mask = mask.resize((size, size), Image.ANTIALIAS)
-                            process.paste(output, coord, outer_mask)
-                else:
-                    plus_fill = exp_fill
-                    # put on ellipse/circle
-                    plus_square = Image.new("RGBA", (raw_length, raw_length))
-                    plus_draw = ImageDraw.Draw(plus_square)
-                    plus_draw.rectangle(
-                        [(0, 0), (raw_length, raw_length)],
-                        fill=(info_fill[0], info_fill[1], info_fill[2], 245),
-                    )
-                    # draw plus signs
-                    margin = 60
-                    thickness = 40
-                    v_left = int(raw_length / 2 - thickness / 2)
-                    v_right = v_left + thickness
-                    v_top = margin
-                    v_bottom = raw_length - margin
-                    plus_draw.rectangle(
-                        [(v_left, v_top), (v_right, v_bottom)],
-                        fill=(plus_fill[0], plus_fill[1], plus_fill[2], 245),
-                    )
-                    h_left = margin
-                    h_right = raw_length - margin
-                    h_top = int(raw_length / 2 - thickness / 2)
-                    h_bottom = h_top + thickness
-                    plus_draw.rectangle(
-                        [(h_left, h_top), (h_right, h_bottom)],
-                        fill=(plus_fill[0], plus_fill[1], plus_fill[2], 245),
-                    )
-                    # put border on ellipse/circle
-                    output = ImageOps.fit(
-                        plus_square, (raw_length, raw_length), centering=(0.5, 0.5)
-                    )
-                    output = output.resize((size, size), Image.ANTIALIAS)
-                    outer_mask = mask.resize((size, size), Image.ANTIALIAS)
-                    process.paste(output, coord, outer_mask)
-
-        result = Image.alpha_composite(result, process)
-        result = await self._add_corners(result, 25)
-        file = BytesIO()
-        result.save(file, "PNG", quality=100)
-        return file.getvalue()
+        else:
+            badges = []
+
+        global_level = await self._find_level(userinfo["total_exp"])
+        exp_frac = int(userinfo["total_exp"] - await self._level_exp(global_level))
+        exp_total = await self._required_exp(global_level + 1)
+        request = {
+            "card": "profile",
+            "key": base_key,
+            "tag": str(user.id),
+            "assets": {"background": bg_url, "avatar": str(user.avatar_url)},
+            "badges": badges,
+            "base": {
+                "badge_circles": badge_type == "circles",
+                "badge_slot_fill": info_fill[:3] + (245,),
+                "badge_plus_fill": exp_fill[:3] + (245,),
+                "name": (await self._truncate_text(user.name, 22)).upper(),
+                "title": userinfo["title"].upper(),
+                "info": userinfo["info"],
+                "info_top": 195 if userinfo["title"] else 170,
+                "info_fill_tx": info_fill[:3] + (150,),
+                "info_box_fill": info_fill[:3] + (255,),
+                "info_text_color": info_text_color,
+                "level_fill": level_fill[:3] + (245,),
+            },
+            "values": {
+                "rep": "{}".format(userinfo["rep"]),
+                "rank": "#{}".format(global_rank),
+                "level": "{}".format(global_level),
+                "bar_length": int(exp_frac / exp_total * 340),
+                "exp": "{}/{}".format(exp_frac, exp_total),
+                "exp_fill": exp_fill[:3] + (255,),
+                "exp_text_color": self._contrast(exp_fill, light_color, dark_color),
+                "credits": f"{bank_credits}{currency}",
+                "info_text_color": info_text_color,
+            },
+            "encoding": encoding,
+        }
+        data, complete = await self._render_card(request, timer)
+        # card with placeholder for image that failed to download isn't kept
+        if complete:
+            self._card_cache.set(card_key, data, tag=str(user.id))
+        timer.finish()
+        return data
 
     # returns color that contrasts better in background
     def _contrast(self, bg_color, color1, color2):
@@ -2729,27 +3005,9 @@ class Leveler(commands.Cog):
         border=3,
         iterations=5,
     ):
-        total_width = image.size[0] + abs(offset[0]) + 2 * border
-        total_height = image.size[1] + abs(offset[1]) + 2 * border
-        back = Image.new(image.mode, (total_width, total_height), background)
-
-        # Place the shadow, taking into account the offset from the image
-        shadow_left = border + max(offset[0], 0)
-        shadow_top = border + max(offset[1], 0)
-        back.paste(
-            shadow,
-            [
-                shadow_left,
-                shadow_top,
-                shadow_left + image.size[0],
-                shadow_top + image.size[1],
-            ],
-        )
-
-        n = 0
-        while n < iterations:
-            back = back.filter(ImageFilter.BLUR)
-            n += 1
+        back = masks.dropshadow(
+            image.size, image.mode, offset, background, shadow, border, iterations
+        ).copy()
 
         # Paste the input image onto the shadow backdrop
         image_left = border - min(offset[0], 0)
@@ -2758,75 +3016,36 @@ class Leveler(commands.Cog):
         return back
 
     async def draw_rank(self, user, server):
-        # fonts
-        font_thin_file = f"{bundled_data_path(self)}/Uni_Sans_Thin.ttf"
-        font_heavy_file = f"{bundled_data_path(self)}/Uni_Sans_Heavy.ttf"
-        font_bold_file = f"{bundled_data_path(self)}/SourceSansPro-Semibold.ttf"
-
-        name_fnt = ImageFont.truetype(font_heavy_file, 24)
-        name_u_fnt = ImageFont.truetype(self.font_unicode_file, 24)
-        label_fnt = ImageFont.truetype(font_bold_file, 16)
-        exp_fnt = ImageFont.truetype(font_bold_file, 9)
-        large_fnt = ImageFont.truetype(font_thin_file, 24)
-        symbol_u_fnt = ImageFont.truetype(self.font_unicode_file, 15)
-
-        async def _write_unicode(text, init_x, y, font, unicode_font, fill):
-            write_pos = init_x
-            check_font = TTFont(font.path)
-
-            for char in text:
-                # if char.isalnum() or char in string.punctuation or char in string.whitespace:
-                if await self.char_in_font(char, check_font):
-                    draw.text((write_pos, y), "{}".format(char), font=font, fill=fill)
-                    write_pos += font.getsize(char)[0]
-                else:
-                    draw.text(
-                        (write_pos, y), "{}".format(char), font=unicode_font, fill=fill
-                    )
-                    write_pos += unicode_font.getsize(char)[0]
+        timer = self._timings.start("rank")
 
         userinfo = db.users.find_one({"user_id": str(user.id)})
         # get urls
         bg_url = userinfo["rank_background"]
+        timer.lap("db")
 
-        async with self.session.get(bg_url) as r:
-            image = await r.content.read()
-        rank_background = BytesIO(image)
-        async with self.session.get(user.avatar_url) as r:
-            image = await r.content.read()
-        rank_avatar = BytesIO(image)
-
-        bg_image = Image.open(rank_background).convert("RGBA")
-        profile_image = Image.open(rank_avatar).convert("RGBA")
-
-        # set canvas
-        width = 390
-        height = 100
-        bg_color = (255, 255, 255, 0)
-        bg_width = width - 50
-        result = Image.new("RGBA", (width, height), bg_color)
-        process = Image.new("RGBA", (width, height), bg_color)
-        draw = ImageDraw.Draw(process)
-
-        # info section
-        info_section = Image.new("RGBA", (bg_width, height), bg_color)
-        info_section_process = Image.new("RGBA", (bg_width, height), bg_color)
-        # puts in background
-        bg_image = bg_image.resize((width, height), Image.ANTIALIAS)
-        bg_image = bg_image.crop((0, 0, width, height))
-        info_section.paste(bg_image, (0, 0))
-
-        # draw transparent overlays
-        draw_overlay = ImageDraw.Draw(info_section_process)
-        draw_overlay.rectangle([(0, 0), (bg_width, 20)], fill=(230, 230, 230, 200))
-        draw_overlay.rectangle(
-            [(0, 20), (bg_width, 30)], fill=(120, 120, 120, 180)
-        )  # Level bar
-        exp_frac = int(userinfo["servers"][str(server.id)]["current_exp"])
-        exp_total = await self._required_exp(
-            userinfo["servers"][str(server.id)]["level"]
+        server_rank = await self._find_server_rank(user, server)
+        timer.lap("rank")
+        bank_credits = await bank.get_balance(user)
+        currency = (await bank.get_currency_name(server))[0]
+        encoding = await self._card_encoding()
+        timer.lap("db")
+        card_key = self._card_key(
+            "rank",
+            user,
+            userinfo,
+            ["rank_background", "rank_info_color"],
+            userinfo["servers"][str(server.id)],
+            server_rank,
+            bank_credits,
+            currency,
+            encoding,
         )
-        exp_width = int(bg_width * (exp_frac / exp_total))
+        cached = self._card_cache.get(card_key)
+        timer.lap("cache")
+        if cached is not None:
+            timer.finish()
+            return cached
+
         if "rank_info_color" in userinfo.keys():
             exp_color = tuple(userinfo["rank_info_color"])
             exp_color = (
@@ -2837,213 +3056,63 @@ class Leveler(commands.Cog):
             )  # increase transparency
         else:
             exp_color = (140, 140, 140, 230)
-        draw_overlay.rectangle([(0, 20), (exp_width, 30)], fill=exp_color)  # Exp bar
-        draw_overlay.rectangle(
-            [(0, 30), (bg_width, 31)], fill=(0, 0, 0, 255)
-        )  # Divider
-        # draw_overlay.rectangle([(0,35), (bg_width,100)], fill=(230,230,230,0)) # title overlay
-        for i in range(0, 70):
-            draw_overlay.rectangle(
-                [(0, height - i), (bg_width, height - i)],
-                fill=(20, 20, 20, 255 - i * 3),
-            )  # title overlay
-
-        # draw corners and finalize
-        info_section = Image.alpha_composite(info_section, info_section_process)
-        info_section = await self._add_corners(info_section, 25)
-        process.paste(info_section, (35, 0))
-
-        # draw level circle
-        multiplier = 6
-        lvl_circle_dia = 100
-        circle_left = 0
-        circle_top = int((height - lvl_circle_dia) / 2)
-        raw_length = lvl_circle_dia * multiplier
-
-        # create mask
-        mask = Image.new("L", (raw_length, raw_length), 0)
-        draw_thumb = ImageDraw.Draw(mask)
-        draw_thumb.ellipse((0, 0) + (raw_length, raw_length), fill=255, outline=0)
-
-        # drawing level border
-        lvl_circle = Image.new("RGBA", (raw_length, raw_length))
-        draw_lvl_circle = ImageDraw.Draw(lvl_circle)
-        draw_lvl_circle.ellipse(
-            [0, 0, raw_length, raw_length], fill=(250, 250, 250, 250)
-        )
-        # put on profile circle background
-        lvl_circle = lvl_circle.resize(
-            (lvl_circle_dia, lvl_circle_dia), Image.ANTIALIAS
-        )
-        lvl_bar_mask = mask.resize((lvl_circle_dia, lvl_circle_dia), Image.ANTIALIAS)
-        process.paste(lvl_circle, (circle_left, circle_top), lvl_bar_mask)
-
-        # draws mask
-        total_gap = 6
-        border = int(total_gap / 2)
-        profile_size = lvl_circle_dia - total_gap
-        raw_length = profile_size * multiplier
-        # put in profile picture
-        output = ImageOps.fit(
-            profile_image, (raw_length, raw_length), centering=(0.5, 0.5)
+
+        base_key = self._card_key(
+            "rank_base", user, userinfo, ["rank_background", "rank_info_color"]
         )
-        output.resize((profile_size, profile_size), Image.ANTIALIAS)
-        mask = mask.resize((profile_size, profile_size), Image.ANTIALIAS)
-        profile_image = profile_image.resize(
-            (profile_size, profile_size), Image.ANTIALIAS
+        exp_frac = int(userinfo["servers"][str(server.id)]["current_exp"])
+        exp_total = await self._required_exp(
+            userinfo["servers"][str(server.id)]["level"]
         )
-        process.paste(profile_image, (circle_left + border, circle_top + border), mask)
-
-        # draw text
-        grey_color = (100, 100, 100, 255)
-        white_color = (220, 220, 220, 255)
-
-        # name
-        await _write_unicode(
-            await self._truncate_text(await self._name(user, 20), 20),
-            100,
-            0,
-            name_fnt,
-            name_u_fnt,
-            grey_color,
-        )  # Name
-
-        # labels
-        v_label_align = 75
-        info_text_color = white_color
-        draw.text(
-            (await self._center(100, 200, "  RANK", label_fnt), v_label_align),
-            "  RANK",
-            font=label_fnt,
-            fill=info_text_color,
-        )  # Rank
-        draw.text(
-            (await self._center(100, 360, "  LEVEL", label_fnt), v_label_align),
-            "  LEVEL",
-            font=label_fnt,
-            fill=info_text_color,
-        )  # Rank
-        draw.text(
-            (await self._center(260, 360, "BALANCE", label_fnt), v_label_align),
-            "BALANCE",
-            font=label_fnt,
-            fill=info_text_color,
-        )  # Rank
-        if "linux" in platform.system().lower():
-            local_symbol = "\U0001F3E0 "
-        else:
-            local_symbol = "S. "
-        await _write_unicode(
-            local_symbol,
-            117,
-            v_label_align + 4,
-            label_fnt,
-            symbol_u_fnt,
-            info_text_color,
-        )  # Symbol
-        await _write_unicode(
-            local_symbol,
-            195,
-            v_label_align + 4,
-            label_fnt,
-            symbol_u_fnt,
-            info_text_color,
-        )  # Symbol
-
-        # userinfo
-        server_rank = "#{}".format(await self._find_server_rank(user, server))
-        draw.text(
-            (await self._center(100, 200, server_rank, large_fnt), v_label_align - 30),
-            server_rank,
-            font=large_fnt,
-            fill=info_text_color,
-        )  # Rank
-        level_text = "{}".format(userinfo["servers"][str(server.id)]["level"])
-        draw.text(
-            (await self._center(95, 360, level_text, large_fnt), v_label_align - 30),
-            level_text,
-            font=large_fnt,
-            fill=info_text_color,
-        )  # Level
-        bank_credits = await bank.get_balance(user)
-        credit_txt = f"{bank_credits}{(await bank.get_currency_name(server))[0]}"
-        draw.text(
-            (await self._center(260, 360, credit_txt, large_fnt), v_label_align - 30),
-            credit_txt,
-            font=large_fnt,
-            fill=info_text_color,
-        )  # Balance
-        exp_text = "{}/{}".format(exp_frac, exp_total)
-        draw.text(
-            (await self._center(80, 360, exp_text, exp_fnt), 19),
-            exp_text,
-            font=exp_fnt,
-            fill=info_text_color,
-        )  # Rank
-
-        result = Image.alpha_composite(result, process)
-        file = BytesIO()
-        result.save(file, "PNG", quality=100)
-        return file.getvalue()
-
-    async def _add_corners(self, im, rad, multiplier=6):
-        raw_length = rad * 2 * multiplier
-        circle = Image.new("L", (raw_length, raw_length), 0)
-        draw = ImageDraw.Draw(circle)
-        draw.ellipse((0, 0, raw_length, raw_length), fill=255)
-        circle = circle.resize((rad * 2, rad * 2), Image.ANTIALIAS)
-
-        alpha = Image.new("L", im.size, 255)
-        w, h = im.size
-        alpha.paste(circle.crop((0, 0, rad, rad)), (0, 0))
-        alpha.paste(circle.crop((0, rad, rad, rad * 2)), (0, h - rad))
-        alpha.paste(circle.crop((rad, 0, rad * 2, rad)), (w - rad, 0))
-        alpha.paste(circle.crop((rad, rad, rad * 2, rad * 2)), (w - rad, h - rad))
-        im.putalpha(alpha)
-        return im
+        request = {
+            "card": "rank",
+            "key": base_key,
+            "tag": str(user.id),
+            "assets": {"background": bg_url, "avatar": str(user.avatar_url)},
+            "base": {
+                "name": await self._truncate_text(await self._name(user, 20), 20),
+                "exp_color": exp_color,
+            },
+            "values": {
+                "exp_width": int(cards.RANK_BAR_WIDTH * (exp_frac / exp_total)),
+                "rank": "#{}".format(server_rank),
+                "level": "{}".format(userinfo["servers"][str(server.id)]["level"]),
+                "credits": f"{bank_credits}{currency}",
+                "exp": "{}/{}".format(exp_frac, exp_total),
+            },
+            "encoding": encoding,
+        }
+        data, complete = await self._render_card(request, timer)
+        # card with placeholder for image that failed to download isn't kept
+        if complete:
+            self._card_cache.set(card_key, data, tag=str(user.id))
+        timer.finish()
+        return data
 
     async def draw_levelup(self, user, server):
-        # fonts
-        font_thin_file = f"{bundled_data_path(self)}/Uni_Sans_Thin.ttf"
-        level_fnt = ImageFont.truetype(font_thin_file, 23)
+        timer = self._timings.start("levelup")
 
         userinfo = db.users.find_one({"user_id": str(user.id)})
 
         # get urls
         bg_url = userinfo["levelup_background"]
 
-        async with self.session.get(bg_url) as r:
-            image = await r.content.read()
-        level_background = BytesIO(image)
-        async with self.session.get(user.avatar_url) as r:
-            image = await r.content.read()
-        level_avatar = BytesIO(image)
-
-        bg_image = Image.open(level_background).convert("RGBA")
-        profile_image = Image.open(level_avatar).convert("RGBA")
-
-        # set canvas
-        width = 176
-        height = 67
-        bg_color = (255, 255, 255, 0)
-        result = Image.new("RGBA", (width, height), bg_color)
-        process = Image.new("RGBA", (width, height), bg_color)
-        draw = ImageDraw.Draw(process)
-
-        # puts in background
-        bg_image = bg_image.resize((width, height), Image.ANTIALIAS)
-        bg_image = bg_image.crop((0, 0, width, height))
-        result.paste(bg_image, (0, 0))
-
-        # info section
-        lvl_circle_dia = 60
-        total_gap = 2
-        border = int(total_gap / 2)
-        info_section = Image.new("RGBA", (165, 55), (230, 230, 230, 20))
-        info_section = await self._add_corners(info_section, int(lvl_circle_dia / 2))
-        process.paste(info_section, (border, border))
-
-        # draw transparent overlay
+        encoding = await self._card_encoding()
+        timer.lap("db")
+        card_key = self._card_key(
+            "levelup",
+            user,
+            userinfo,
+            ["levelup_background", "levelup_info_color"],
+            userinfo["servers"][str(server.id)]["level"],
+            encoding,
+        )
+        cached = self._card_cache.get(card_key)
+        timer.lap("cache")
+        if cached is not None:
+            timer.finish()
+            return cached
+
         if "levelup_info_color" in userinfo.keys():
             info_color = tuple(userinfo["levelup_info_color"])
             info_color = (
@@ -3055,96 +3124,146 @@ class Leveler(commands.Cog):
         else:
             info_color = (30, 30, 30, 150)
 
-        for i in range(0, height):
-            draw.rectangle(
-                [(0, height - i), (width, height - i)],
-                fill=(info_color[0], info_color[1], info_color[2], 255 - i * 3),
-            )  # title overlay
-
-        # draw circle
-        multiplier = 6
-        circle_left = 4
-        circle_top = int((height - lvl_circle_dia) / 2)
-        raw_length = lvl_circle_dia * multiplier
-        # create mask
-        mask = Image.new("L", (raw_length, raw_length), 0)
-        draw_thumb = ImageDraw.Draw(mask)
-        draw_thumb.ellipse((0, 0) + (raw_length, raw_length), fill=255, outline=0)
-
-        # border
-        lvl_circle = Image.new("RGBA", (raw_length, raw_length))
-        draw_lvl_circle = ImageDraw.Draw(lvl_circle)
-        draw_lvl_circle.ellipse(
-            [0, 0, raw_length, raw_length], fill=(250, 250, 250, 180)
-        )
-        lvl_circle = lvl_circle.resize(
-            (lvl_circle_dia, lvl_circle_dia), Image.ANTIALIAS
-        )
-        lvl_bar_mask = mask.resize((lvl_circle_dia, lvl_circle_dia), Image.ANTIALIAS)
-        process.paste(lvl_circle, (circle_left, circle_top), lvl_bar_mask)
-
-        profile_size = lvl_circle_dia - total_gap
-        raw_length = profile_size * multiplier
-        # put in profile picture
-        output = ImageOps.fit(
-            profile_image, (raw_length, raw_length), centering=(0.5, 0.5)
+        base_key = self._card_key(
+            "levelup_base",
+            user,
+            userinfo,
+            ["levelup_background", "levelup_info_color"],
         )
-        output.resize((profile_size, profile_size), Image.ANTIALIAS)
-        mask = mask.resize((profile_size, profile_size), Image.ANTIALIAS)
-        profile_image = profile_image.resize(
-            (profile_size, profile_size), Image.ANTIALIAS
-        )
-        process.paste(profile_image, (circle_left + border, circle_top + border), mask)
-
         # write label text
         white_text = (250, 250, 250, 255)
         dark_text = (35, 35, 35, 230)
-        level_up_text = self._contrast(info_color, white_text, dark_text)
-        lvl_text = "LEVEL {}".format(userinfo["servers"][str(server.id)]["level"])
-        draw.text(
-            (await self._center(60, 170, lvl_text, level_fnt), 23),
-            lvl_text,
-            font=level_fnt,
-            fill=level_up_text,
-        )  # Level Number
-
-        result = Image.alpha_composite(result, process)
-        result = await self._add_corners(result, int(height / 2))
-        file = BytesIO()
-        result.save(file, "PNG", quality=100)
-        return file.getvalue()
+        request = {
+            "card": "levelup",
+            "key": base_key,
+            "tag": str(user.id),
+            "assets": {"background": bg_url, "avatar": str(user.avatar_url)},
+            "base": {"info_color": info_color[:3]},
+            "values": {
+                "level": "LEVEL {}".format(
+                    userinfo["servers"][str(server.id)]["level"]
+                ),
+                "text_color": self._contrast(info_color, white_text, dark_text),
+            },
+            "encoding": encoding,
+        }
+        data, complete = await self._render_card(request, timer)
+        # card with placeholder for image that failed to download isn't kept
+        if complete:
+            self._card_cache.set(card_key, data, tag=str(user.id))
+        timer.finish()
+        return data
+
+    async def _send_card(self, channel, card, data, content):
+        """Send rendered card.
+
+        Same image uploaded shortly before to the same channel is shown from
+        its attachment url, instead of being uploaded again."""
+        # urls are not shared between channels, they would show where image
+        # was sent first, and break when that message is deleted
+        key = (channel.id, hashlib.sha256(data).digest())
+        # level-ups may be sent to DMs
+        can_embed = (
+            not isinstance(channel, discord.abc.GuildChannel)
+            or channel.permissions_for(channel.guild.me).embed_links
+        )
+        with self._timings.time(card, "upload"):
+            uploaded = self._attachment_urls.get(key)
+            if (
+                can_embed
+                and uploaded is not None
+                and time.time() - uploaded[1] < ATTACHMENT_TTL
+            ):
+                em = discord.Embed()
+                em.set_image(url=uploaded[0])
+                return await channel.send(content, embed=em)
+            file = discord.File(
+                BytesIO(data), filename=f"{card}.{await self.config.card_format()}"
+            )
+            message = await channel.send(content, file=file)
+            if message.attachments:
+                self._attachment_urls.set(
+                    key, (message.attachments[0].url, time.time())
+                )
+            return message
+
+    async def _render_card(self, request, timer):
+        """Draw card in render daemon, or here if daemon is not available.
+
+        Returns (card, whether every image of it was loaded)."""
+        path = await self.config.render_socket()
+        if path is not None:
+            if self._daemon is None or self._daemon.path != path:
+                self._daemon = RenderClient(path)
+            try:
+                return await self._daemon.render(request, timer)
+            except DaemonUnavailable as e:
+                log.debug(f"Rendering {request['card']} card here, daemon failed: {e}")
+        return await self._local_renderer.render(request, timer)
+
+    async def _card_encoding(self):
+        return (
+            await self.config.card_format(),
+            await self.config.png_compress_level(),
+            await self.config.png_quantize(),
+        )
+
+    def _card_key(self, card_type, user, userinfo, fields, *inputs):
+        """Hash of everything a card is rendered from."""
+        key = [card_type, user.name, user.display_name, str(user.avatar_url)]
+        key.extend(userinfo.get(field) for field in fields)
+        key.extend(inputs)
+        return hashlib.sha256(
+            json.dumps(key, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    # drops cards that can't be requested anymore after user data changes
+    def _invalidate_cards(self, user_id):
+        self._card_cache.invalidate(str(user_id))
+
+    # same, but for changes of card appearance
+    def _invalidate_layers(self, user_id):
+        self._layer_cache.invalidate(str(user_id))
+        self._card_cache.invalidate(str(user_id))
+
+    async def _message_filter_guild(self, message):
+        config = self.config.guild(message.guild)
+        return (
+            await config.disabled(),
+            frozenset(await config.ignored_channels()),
+            tuple(await self.bot.command_prefix(self.bot, message)),
+        )
 
     async def _handle_on_message(self, message):
-        text = message.content
+        # most messages can't give exp, they are skipped before database
+        if await self._message_filter.check(message):
+            self._exp_queue.put(message.guild.id, message)
+
+    # pymongo calls block, ones made for every message run in executor, so slow
+    # database holds up only exp queue shard that waits for it
+    async def _run_db(self, func, *args, **kwargs):
+        return await self.bot.loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+    async def _process_message(self, message):
         server = message.guild
         user = message.author
-        prefix = await self.bot.command_prefix(self.bot, message)
         # creates user if doesn't exist, bots are not logged.
         await self._create_user(user, server)
         curr_time = time.time()
-        userinfo = db.users.find_one({"user_id": str(user.id)})
-
-        if not server or await self.config.guild(server).disabled():
-            return
-        if user.bot:
-            return
-
-        # check if chat_block exists
-        if "chat_block" not in userinfo:
-            userinfo["chat_block"] = 0
-
-        if "last_message" not in userinfo:
-            userinfo["last_message"] = 0
-        if all(
-            [
-                float(curr_time) - float(userinfo["chat_block"]) >= 120,
-                not any(text.startswith(x) for x in prefix),
-                len(message.content) > 10 or message.attachments,
-                message.content != userinfo["last_message"],
-                message.channel.id
-                not in await self.config.guild(server).ignored_channels(),
-            ]
-        ):
+        # filter doesn't know about exp given before restart or by other bot shards.
+        # cooldown is claimed in one update, exp queue shards may process
+        # messages of the same user at once
+        claimed = await self._run_db(
+            db.users.update_one,
+            {
+                "user_id": str(user.id),
+                "chat_block": {"$not": {"$gt": curr_time - 120}},
+                "last_message": {"$ne": message.content},
+            },
+            {"$set": {"chat_block": curr_time, "last_message": message.content}},
+        )
+        if claimed.modified_count:
+            userinfo = await self._run_db(db.users.find_one, {"user_id": str(user.id)})
             await self._process_exp(message, userinfo, random.randint(15, 20))
             await self._give_chat_credit(user, server)
         # except AttributeError as e:
@@ -3154,51 +3273,54 @@ class Leveler(commands.Cog):
         server = message.guild
         channel = message.channel
         user = message.author
+        self._invalidate_cards(user.id)
+        self._message_filter.gave_exp(user.id, message.content)
         # add to total exp
         required = await self._required_exp(
             userinfo["servers"][str(server.id)]["level"]
         )
+        # counters are incremented, not set, exp of other shards may be
+        # written between reading and updating them
         try:
-            db.users.update_one(
+            await self._run_db(
+                db.users.update_one,
                 {"user_id": str(user.id)},
-                {"$set": {"total_exp": userinfo["total_exp"] + exp}},
+                {"$inc": {"total_exp": exp}},
             )
         except Exception as exc:
             log.error(f"Unable to process xp for {user.id}: {exc}")
         if userinfo["servers"][str(server.id)]["current_exp"] + exp >= required:
             userinfo["servers"][str(server.id)]["level"] += 1
-            db.users.update_one(
+            await self._run_db(
+                db.users.update_one,
                 {"user_id": str(user.id)},
                 {
-                    "$set": {
-                        "servers.{}.level".format(server.id): userinfo["servers"][
-                            str(server.id)
-                        ]["level"],
-                        "servers.{}.current_exp".format(server.id): userinfo["servers"][
-                            str(server.id)
-                        ]["current_exp"]
-                        + exp
-                        - required,
-                        "chat_block": time.time(),
-                        "last_message": message.content,
+                    "$inc": {
+                        "servers.{}.level".format(server.id): 1,
+                        "servers.{}.current_exp".format(server.id): exp - required,
                     }
                 },
             )
             await self._handle_levelup(user, userinfo, server, channel)
         else:
-            db.users.update_one(
+            await self._run_db(
+                db.users.update_one,
                 {"user_id": str(user.id)},
-                {
-                    "$set": {
-                        "servers.{}.current_exp".format(server.id): userinfo["servers"][
-                            str(server.id)
-                        ]["current_exp"]
-                        + exp,
-                        "chat_block": time.time(),
-                        "last_message": message.content,
-                    }
-                },
+                {"$inc": {"servers.{}.current_exp".format(server.id): exp}},
             )
+        # after all counters are updated, ledger can't leave them half done
+        await self._record_exp(server, user, exp)
+        await self._warm_rank(user, server)
+
+    # users often check their rank right after gaining exp
+    async def _warm_rank(self, user, server):
+        if not await self.config.warm_cards():
+            return
+        if await self.config.guild(server).text_only():
+            return
+        self._warmer.warm(
+            ("rank", user.id, server.id), partial(self.draw_rank, user, server)
+        )
 
     async def _handle_levelup(self, user, userinfo, server, channel):
         # channel lock implementation
@@ -3215,59 +3337,9 @@ class Leveler(commands.Cog):
             name = "You"
 
         new_level = str(userinfo["servers"][str(server.id)]["level"])
-        # add to appropriate role if necessary
-        # try:
-        server_roles = db.roles.find_one({"server_id": str(server.id)})
-        if server_roles is not None:
-            for role in server_roles["roles"].keys():
-                if int(server_roles["roles"][role]["level"]) == int(new_level):
-                    add_role = discord.utils.get(server.roles, name=role)
-                    if add_role is not None:
-                        try:
-                            await user.add_roles(add_role, reason="Levelup")
-                        except discord.Forbidden:
-                            await channel.send(
-                                "Levelup role adding failed: Missing Permissions"
-                            )
-                        except discord.HTTPException:
-                            await channel.send("Levelup role adding failed")
-                    remove_role = discord.utils.get(
-                        server.roles, name=server_roles["roles"][role]["remove_role"]
-                    )
-                    if remove_role is not None:
-                        try:
-                            await user.remove_roles(remove_role, reason="Levelup")
-                        except discord.Forbidden:
-                            await channel.send(
-                                "Levelup role removal failed: Missing Permissions"
-                            )
-                        except discord.HTTPException:
-                            await channel.send("Levelup role removal failed")
-        try:
-            server_linked_badges = db.badgelinks.find_one({"server_id": str(server.id)})
-            if server_linked_badges is not None:
-                for badge_name in server_linked_badges["badges"]:
-                    if int(server_linked_badges["badges"][badge_name]) == int(
-                        new_level
-                    ):
-                        server_badges = db.badges.find_one(
-                            {"server_id": str(server.id)}
-                        )
-                        if (
-                            server_badges is not None
-                            and badge_name in server_badges["badges"].keys()
-                        ):
-                            userinfo_db = db.users.find_one({"user_id": str(user.id)})
-                            new_badge_name = "{}_{}".format(badge_name, server.id)
-                            userinfo_db["badges"][new_badge_name] = server_badges[
-                                "badges"
-                            ][badge_name]
-                            db.users.update_one(
-                                {"user_id": str(user.id)},
-                                {"$set": {"badges": userinfo_db["badges"]}},
-                            )
-        except Exception as exc:
-            await channel.send(f"Error. Badge was not given: {exc}")
+        rewards = self._level_rewards(server).get(int(new_level))
+        if rewards is not None:
+            await self._give_rewards(user, server, channel, rewards)
 
         if await self.config.guild(server).lvl_msg():  # if lvl msg is enabled
             if await self.config.guild(server).text_only():
@@ -3281,14 +3353,62 @@ class Leveler(commands.Cog):
                 channel.send(embed=em)
             else:
                 async with channel.typing():
-                    levelup = await self.draw_levelup(user, server)
-                    file = discord.File(levelup, filename="levelup.png")
-                    await channel.send(
+                    levelup = await self._renderer.render(
+                        ("levelup", user.id, server.id),
+                        partial(self.draw_levelup, user, server),
+                        priority=RenderScheduler.PRIORITY_LEVELUP,
+                        timeout=LEVELUP_DEADLINE,
+                    )
+                if levelup is None:
+                    log.debug(f"Level-up card for {user.id} dropped, queue is too long")
+                else:
+                    await self._send_card(
+                        channel,
+                        "levelup",
+                        levelup,
                         "**{} just gained a level{}!**".format(name, server_identifier),
-                        file=file,
                     )
             self.bot.dispatch("leveler_levelup", user, new_level)
 
+    def _level_rewards(self, server):
+        if server.id not in self._rewards:
+            self._rewards[server.id] = build_rewards(
+                server,
+                db.roles.find_one({"server_id": str(server.id)}),
+                db.badgelinks.find_one({"server_id": str(server.id)}),
+                db.badges.find_one({"server_id": str(server.id)}),
+            )
+        return self._rewards[server.id]
+
+    # roles are linked by name, so index is rebuilt when roles change
+    async def _forget_rewards(self, role, *args):
+        self._rewards.pop(role.guild.id, None)
+
+    async def _give_rewards(self, user, server, channel, rewards):
+        roles = roles_after(user, rewards)
+        if roles is not None:
+            try:
+                await user.edit(roles=roles, reason="Levelup")
+            except discord.Forbidden:
+                await channel.send("Levelup role update failed: Missing Permissions")
+            except discord.HTTPException:
+                await channel.send("Levelup role update failed")
+        if rewards.badges:
+            try:
+                await self._run_db(
+                    db.users.update_one,
+                    {"user_id": str(user.id)},
+                    {
+                        "$set": {
+                            "badges.{}_{}".format(name, server.id): badge
+                            for name, badge in rewards.badges.items()
+                        }
+                    },
+                )
+                self._invalidate_layers(user.id)
+            except Exception as exc:
+                await channel.send(f"Error. Badge was not given: {exc}")
+
     async def _find_server_rank(self, user, server):
         targetid = str(user.id)
         users = []
@@ -3379,10 +3499,9 @@ class Leveler(commands.Cog):
         if user.bot:
             return
         try:
-            userinfo = db.users.find_one({"user_id": str(user.id)})
+            userinfo = await self._run_db(db.users.find_one, {"user_id": str(user.id)})
             if not userinfo:
                 new_account = {
-                    "user_id": str(user.id),
                     "username": user.name,
                     "servers": {},
                     "total_exp": 0,
@@ -3402,27 +3521,41 @@ class Leveler(commands.Cog):
                     "profile_block": 0,
                     "rank_block": 0,
                 }
-                db.users.insert_one(new_account)
+                # upsert, so messages processed at once create one document
+                try:
+                    await self._run_db(
+                        db.users.update_one,
+                        {"user_id": str(user.id)},
+                        {"$setOnInsert": new_account},
+                        upsert=True,
+                    )
+                except pymongo.errors.DuplicateKeyError:
+                    pass  # created by concurrent upsert
 
-            userinfo = db.users.find_one({"user_id": str(user.id)})
+            userinfo = await self._run_db(db.users.find_one, {"user_id": str(user.id)})
 
             if "username" not in userinfo or userinfo["username"] != user.name:
-                db.users.update_one(
+                await self._run_db(
+                    db.users.update_one,
                     {"user_id": str(user.id)},
                     {"$set": {"username": user.name}},
                     upsert=True,
                 )
 
             if "servers" not in userinfo or str(server.id) not in userinfo["servers"]:
-                db.users.update_one(
-                    {"user_id": str(user.id)},
+                # exp given meanwhile isn't reset
+                await self._run_db(
+                    db.users.update_one,
+                    {
+                        "user_id": str(user.id),
+                        "servers.{}".format(server.id): {"$exists": False},
+                    },
                     {
                         "$set": {
                             "servers.{}.level".format(server.id): 0,
                             "servers.{}.current_exp".format(server.id): 0,
                         }
                     },
-                    upsert=True,
                 )
         except AttributeError:
             pass
@@ -3448,13 +3581,19 @@ class Leveler(commands.Cog):
     async def _level_exp(self, level: int):
         return level * 65 + 139 * level * (level - 1) // 2
 
+    async def _record_exp(self, server, user, delta: int):
+        if delta and await self.config.exp_ledger():
+            self._ledger.record(server.id, user.id, delta)
+
+    async def _level_for_exp(self, exp: int):
+        level = await self._find_level(exp)
+        # formula is not exact at level boundaries
+        while await self._level_exp(level + 1) <= exp:
+            level += 1
+        while level > 0 and await self._level_exp(level) > exp:
+            level -= 1
+        return level
+
     async def _find_level(self, total_exp):
         # this is specific to the function above
         return int((1 / 278) * (9 + math.sqrt(81 + 1112 * total_exp)))
-
-    async def char_in_font(self, unicode_char, font):
-        for cmap in font["cmap"].tables:
-            if cmap.isUnicode():
-                if ord(unicode_char) in cmap.cmap:
-                    return True
-        return False
@@ -0,0 +1,146 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# Geometry-only layers shared by every card renderer.
+# Cached images are shared between calls, so callers must only read them
+# (use them as paste sources or masks) and never draw on them in place.
+# Shapes are antialiased analytically: coverage of every pixel is estimated
+# from signed distance of its center to the edge of shape, at output size.
+
+
+def _coverage(distance):
+    """Part of pixel covered by shape, `distance` is negative inside it."""
+    return np.clip(0.5 - distance, 0, 1)
+
+
+def _offsets(length):
+    """Offsets of pixel centers from the middle of `length`."""
+    return np.arange(length, dtype=np.float64) + 0.5 - length / 2
+
+
+def _span(length, start, end):
+    """Covered part of every pixel in a row for segment [start, end)."""
+    left = np.arange(length, dtype=np.float64)
+    return np.clip(np.minimum(left + 1, end) - np.maximum(left, start), 0, 1)
+
+
+def _radii(size):
+    """Distances of pixel centers from the middle of square `size`."""
+    return np.hypot(_offsets(size)[None, :], _offsets(size)[:, None])
+
+
+def circle(size: int, inset: float = 0):
+    """Coverage of square `size` by an inscribed circle, shrunk by `inset`."""
+    return _coverage(_radii(size) - (size / 2 - inset))
+
+
+def arc(size: int, width: float, start: float = 0, end: float = 360):
+    """Coverage of square `size` by a ring of `width`, going clockwise from
+    `start` to `end` degrees, 0 is at the top."""
+    radius = _radii(size)
+    coverage = _coverage(np.abs(radius - (size - width) / 2) - width / 2)
+    if end - start >= 360:
+        return coverage
+    # distance to the nearest end of arc, measured along the ring
+    middle = math.radians((start + end) / 2)
+    half = math.radians((end - start) / 2)
+    offsets = _offsets(size)
+    angle = np.arctan2(offsets[None, :], -offsets[:, None])
+    delta = np.abs((angle - middle + math.pi) % (2 * math.pi) - math.pi)
+    return np.minimum(coverage, _coverage((delta - half) * radius))
+
+
+def _mask(coverage):
+    return Image.fromarray(np.round(coverage * 255).astype(np.uint8), "L")
+
+
+def _paint(*layers):
+    """RGBA image of (color, coverage) layers, each replaces the ones below it
+    where it covers them."""
+    premultiplied = 0
+    for color, coverage in layers:
+        rgba = np.array(color, dtype=np.float64)
+        rgba[:3] *= rgba[3] / 255
+        premultiplied = premultiplied * (1 - coverage[..., None])
+        premultiplied = premultiplied + coverage[..., None] * rgba
+    alpha = premultiplied[..., 3:]
+    rgb = np.divide(
+        premultiplied[..., :3] * 255,
+        alpha,
+        out=np.zeros_like(premultiplied[..., :3]),
+        where=alpha > 0,
+    )
+    rgba = np.concatenate((rgb, alpha), axis=2)
+    return Image.fromarray(np.round(rgba).clip(0, 255).astype(np.uint8), "RGBA")
+
+
+@lru_cache(maxsize=64)
+def circle_mask(size: int):
+    """Antialiased circle mask."""
+    return _mask(circle(size))
+
+
+@lru_cache(maxsize=64)
+def filled_circle(size: int, fill: tuple, outline: tuple = None):
+    """Antialiased solid circle, used as border behind avatars and badges.
+
+    `outline` is color of its outermost pixel."""
+    layers = [(outline or fill, circle(size))]
+    if outline:
+        layers.append((fill, circle(size, inset=1)))
+    return _paint(*layers)
+
+
+@lru_cache(maxsize=32)
+def plus_badge(size: int, fill: tuple, plus_fill: tuple):
+    """Empty badge slot with a plus sign."""
+    margin = size * 0.26
+    thickness = size * 0.18
+    bar = _span(size, (size - thickness) / 2, (size + thickness) / 2)
+    line = _span(size, margin, size - margin)
+    plus = np.maximum(bar[None, :] * line[:, None], line[None, :] * bar[:, None])
+    return _paint((fill, np.ones((size, size))), (plus_fill, plus))
+
+
+@lru_cache(maxsize=32)
+def corner_alpha(size: tuple, rad: int):
+    """Alpha channel of `size` with antialiased rounded corners of radius `rad`."""
+    circle = circle_mask(rad * 2)
+    alpha = Image.new("L", size, 255)
+    w, h = size
+    alpha.paste(circle.crop((0, 0, rad, rad)), (0, 0))
+    alpha.paste(circle.crop((0, rad, rad, rad * 2)), (0, h - rad))
+    alpha.paste(circle.crop((rad, 0, rad * 2, rad)), (w - rad, 0))
+    alpha.paste(circle.crop((rad, rad, rad * 2, rad * 2)), (w - rad, h - rad))
+    return alpha
+
+
+@lru_cache(maxsize=16)
+def dropshadow(
+    size: tuple,
+    mode: str,
+    offset: tuple,
+    background,
+    shadow,
+    border: int,
+    iterations: int,
+):
+    """Blurred shadow backdrop for an image of `size`."""
+    total_width = size[0] + abs(offset[0]) + 2 * border
+    total_height = size[1] + abs(offset[1]) + 2 * border
+    back = Image.new(mode, (total_width, total_height), background)
+
+    # Place the shadow, taking into account the offset from the image
+    shadow_left = border + max(offset[0], 0)
+    shadow_top = border + max(offset[1], 0)
+    back.paste(
+        shadow,
+        [shadow_left, shadow_top, shadow_left + size[0], shadow_top + size[1]],
+    )
+
+    for _ in range(iterations):
+        back = back.filter(ImageFilter.BLUR)
+    return back
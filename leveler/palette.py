@@ -0,0 +1,50 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+SAMPLE_SIZE = (128, 128)  # image is downsampled to this before clustering
+
+
+def _nearest(points, centers):
+    """Index of the closest center for every point."""
+    distances = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+    return distances.argmin(axis=1)
+
+
+def dominant_colors(
+    data: bytes, clusters: int = 10, batch: int = 256, iterations: int = 40
+):
+    """Hex colors of image, most abundant first.
+
+    Colors are centers of mini-batch k-means over downsampled pixels."""
+    image = Image.open(BytesIO(data))
+    image.draft("RGB", SAMPLE_SIZE)
+    image = image.convert("RGB")
+    image.thumbnail(SAMPLE_SIZE)
+    pixels = np.asarray(image, dtype=np.float32).reshape(-1, 3)
+
+    # fixed seed, so same background always gets same colors
+    rng = np.random.RandomState(0)
+    clusters = min(clusters, len(pixels))
+    centers = pixels[rng.choice(len(pixels), clusters, replace=False)].copy()
+    counts = np.zeros(clusters, dtype=np.float32)
+    for _ in range(iterations):
+        sample = pixels[rng.randint(0, len(pixels), batch)]
+        labels = _nearest(sample, centers)
+        batch_counts = np.bincount(labels, minlength=clusters).astype(np.float32)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, sample)
+        counts += batch_counts
+        # move every center towards mean of its points, by 1 / points seen
+        moved = batch_counts > 0
+        centers[moved] += (
+            sums[moved] - batch_counts[moved, None] * centers[moved]
+        ) / counts[moved, None]
+
+    abundance = np.bincount(_nearest(pixels, centers), minlength=clusters)
+    order = np.argsort(-abundance, kind="stable")
+    return [
+        "".join(format(int(c), "02x") for c in centers[i].round().clip(0, 255))
+        for i in order
+    ]
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+
+import discord
+
+from .rewards import roles_after
+
+log = logging.getLogger("red.fixator10-cogs.leveler")
+
+
+class RoleSync:
+    """Gives guild members linked roles of levels they already reached.
+
+    Members are read from `users` collection in batches ordered by user id,
+    every batch is a new query after the last id, so no cursor is kept open
+    while roles are edited. After every batch its last id is passed to
+    `save_checkpoint`, so stopped sync continues from there. Role edits run
+    `concurrency` at a time and start at least `interval` seconds apart,
+    discord.py waits out rate limits on top of that. Missing Permissions
+    stops the sync, edits of its batch that didn't start yet are cancelled."""
+
+    BATCH = 100
+
+    def __init__(
+        self,
+        server,
+        users,
+        rewards,
+        save_checkpoint,
+        checkpoint=None,
+        concurrency: int = 2,
+        interval: float = 0.5,
+    ):
+        self.server = server
+        self.users = users
+        self.rewards = rewards  # function returning level -> Rewards
+        self.save_checkpoint = save_checkpoint
+        self.checkpoint = checkpoint
+        self.interval = interval
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._next_edit = 0
+        self.query = {"servers.{}".format(server.id): {"$exists": True}}
+        self.total = users.count_documents(self.query)
+        self.resumed = 0 if checkpoint is None else self._count_before(checkpoint)
+        self.checked = 0
+        self.changed = 0
+        self.missing = 0
+        self.failed = 0
+
+    def _count_before(self, user_id):
+        return self.users.count_documents(dict(self.query, user_id={"$lte": user_id}))
+
+    async def run(self):
+        while True:
+            query = dict(self.query)
+            if self.checkpoint is not None:
+                query["user_id"] = {"$gt": self.checkpoint}
+            rows = list(
+                self.users.find(
+                    query, {"user_id": 1, "servers.{}.level".format(self.server.id): 1}
+                )
+                .sort("user_id", 1)
+                .limit(self.BATCH)
+            )
+            if not rows:
+                break
+            # links may change while sync runs
+            index = self.rewards()
+            tasks = [asyncio.ensure_future(self._sync(row, index)) for row in rows]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                # on Missing Permissions (or cancel) rest of batch doesn't edit roles
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            self.checkpoint = rows[-1]["user_id"]
+            await self.save_checkpoint(self.checkpoint)
+        await self.save_checkpoint(None)
+
+    async def _sync(self, row, index):
+        member = self.server.get_member(int(row["user_id"]))
+        self.checked += 1
+        if member is None:
+            self.missing += 1
+            return
+        level = row["servers"][str(self.server.id)]["level"]
+        roles = roles_after(
+            member, *(index[reward] for reward in sorted(index) if reward <= level)
+        )
+        if roles is None:
+            return
+        async with self._semaphore:
+            loop = asyncio.get_event_loop()
+            delay = self._next_edit - loop.time()
+            self._next_edit = max(self._next_edit, loop.time()) + self.interval
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await member.edit(roles=roles, reason="Level role sync")
+            except discord.Forbidden:
+                raise
+            except discord.HTTPException as e:
+                self.failed += 1
+                log.debug(f"Unable to sync roles of {member.id}: {e}")
+                return
+        self.changed += 1
+
+    def progress(self):
+        done = self.resumed + self.checked
+        percent = done * 100 // self.total if self.total else 100
+        return (
+            f"{done}/{self.total} members checked ({percent}%), "
+            f"{self.changed} updated, {self.missing} not on server, "
+            f"{self.failed} failed"
+        )
@@ -0,0 +1,189 @@
+import logging
+from asyncio import TimeoutError as AsyncTimeoutError, gather
+from io import BytesIO
+
+import aiohttp
+from PIL import Image
+
+from . import cards
+from .cache import LRUCache
+from .encoding import encode_card
+from .layout import compile_layout
+
+log = logging.getLogger("red.fixator10-cogs.leveler")
+
+# limits for images downloaded while drawing cards
+ASSET_TIMEOUT = 10  # seconds, per image
+ASSET_MAX_BYTES = 8 * 1024 * 1024
+ASSET_MAX_PIXELS = 4096 * 4096  # after reduced decoding, bigger images are rejected
+ASSET_CONNECTIONS_PER_HOST = 4
+
+# card -> (static layout, dynamic layout, downloaded images, variants of static
+# layers, every variant is drawn with its values added to base values)
+CARDS = {
+    "profile": (cards.PROFILE_BASE, cards.PROFILE_VALUES, cards.PROFILE_ASSETS, ({},)),
+    "rank": (
+        cards.RANK_BASE,
+        cards.RANK_VALUES,
+        cards.RANK_ASSETS,
+        # second variant has full exp bar, it's cut to exp width
+        ({"bar_width": None}, {"bar_width": cards.RANK_BAR_WIDTH}),
+    ),
+    "levelup": (cards.LEVELUP_BASE, cards.LEVELUP_VALUES, cards.LEVELUP_ASSETS, ({},)),
+}
+
+
+async def fetch_asset(session, url):
+    """Download image for card, None if it's too big, too slow or unavailable."""
+    try:
+        async with session.get(
+            str(url), timeout=aiohttp.ClientTimeout(total=ASSET_TIMEOUT)
+        ) as r:
+            if r.status != 200:
+                return None
+            if r.content_length and r.content_length > ASSET_MAX_BYTES:
+                return None
+            data = bytearray()
+            async for chunk in r.content.iter_chunked(64 * 1024):
+                data.extend(chunk)
+                if len(data) > ASSET_MAX_BYTES:
+                    return None
+            return bytes(data)
+    except (aiohttp.ClientError, AsyncTimeoutError, ValueError) as e:
+        log.debug(f"Unable to fetch {url}: {e}")
+        return None
+
+
+# all images of card are downloaded at once, so slowest one limits card time
+async def fetch_assets(session, *urls):
+    return await gather(*[fetch_asset(session, url) for url in urls])
+
+
+def open_asset(data, placeholder=None, size=None):
+    """Decode downloaded image, or get placeholder of `placeholder` color.
+
+    If image will be resized to `size`, JPEGs are decoded at reduced scale,
+    but not smaller than `size`."""
+    if data is not None:
+        try:
+            image = Image.open(BytesIO(data))
+            if size is not None:
+                image.draft("RGB", size)
+            # only header is read so far, so bombs are rejected before decoding
+            if image.width * image.height > ASSET_MAX_PIXELS:
+                raise IOError(f"image is too big: {image.width}x{image.height}")
+            return image.convert("RGBA")
+        except (IOError, Image.DecompressionBombError) as e:
+            log.debug(f"Unable to open image: {e}")
+    if placeholder is not None:
+        return Image.new("RGBA", (1, 1), placeholder)
+    return None
+
+
+def layers_size(layers):
+    """Memory used by static layers of card, for LRUCache."""
+    return sum(layer.width * layer.height * len(layer.getbands()) for layer in layers)
+
+
+def _tuples(value):
+    # colors and boxes may come as lists from JSON
+    if isinstance(value, list):
+        return tuple(_tuples(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _tuples(v) for k, v in value.items()}
+    return value
+
+
+class CardRenderer:
+    """Draws cards from render requests, in the cog or in render daemon.
+
+    Request is a JSON-compatible dict:
+        card      "profile", "rank" or "levelup"
+        key       hash of everything static layers are drawn from
+        tag       tag of static layers in `layers` cache (user id)
+        assets    slot -> url, of images of static layers
+        badges    [[url, border color], ...] of profile badges
+        base      values of static layers
+        values    values drawn on every render, rank card gets its exp bar
+                  cut from second variant of static layers by `exp_width`
+        encoding  [format, png compress level, png quantize]
+
+    Static layers are kept in `layers` cache by `key`, unless an image
+    failed to download or open and a placeholder was drawn instead, so the
+    next render tries again. Badge that failed again is left empty, and
+    doesn't keep layers out of cache. `render` returns (card, complete),
+    incomplete cards shouldn't be cached either."""
+
+    def __init__(self, font_dir: str, session, layers):
+        self.font_dir = font_dir
+        self.session = session
+        self.layers = layers
+        # urls of badges that failed to load last time
+        self._failed_badges = LRUCache(1024, sizeof=lambda failed: 1)
+
+    async def render(self, request, timer=None):
+        request = _tuples(request)
+        base_layout, values_layout, assets, variants = CARDS[request["card"]]
+        layers = self.layers.get(request["key"])
+        if timer is not None:
+            timer.lap("cache")
+        complete = True
+        if layers is None:
+            layers, complete = await self._draw_base(
+                request, base_layout, assets, variants, values_layout.overlay, timer
+            )
+            if complete:
+                self.layers.set(request["key"], layers, tag=request.get("tag"))
+
+        values = dict(request["values"])
+        if "exp_width" in values:
+            values["exp_bar"] = layers[1].crop((35, 20, 36 + values["exp_width"], 30))
+        # dynamic overlay is drawn on static one, that is composited with it
+        process = layers[1].copy() if values_layout.overlay else None
+        result = compile_layout(values_layout, self.font_dir).draw(
+            values, layers[0].copy(), timer, process
+        )
+        data = encode_card(result, *request["encoding"])
+        if timer is not None:
+            timer.lap("encode")
+        return data, complete
+
+    async def _draw_base(self, request, layout, assets, variants, split, timer):
+        slots = list(assets)
+        badges = request.get("badges", ())
+        images = await fetch_assets(
+            self.session,
+            *[request["assets"][slot] for slot in slots],
+            *[url for url, _ in badges],
+        )
+        if timer is not None:
+            timer.lap("fetch")
+        values = dict(request["base"])
+        complete = True
+        for slot, data in zip(slots, images):
+            placeholder, size = assets[slot]
+            values[slot] = open_asset(data, size=size)
+            if values[slot] is None:
+                values[slot] = open_asset(None, placeholder)
+                complete = False
+        # badges with broken images leave their slot empty
+        values["badges"] = []
+        for (url, border_color), data in zip(badges, images[len(slots) :]):
+            badge = open_asset(data, size=cards.BADGE_SIZE)
+            if badge is not None:
+                self._failed_badges.pop(url)
+            elif url not in self._failed_badges:
+                self._failed_badges.set(url, True)
+                complete = False
+            values["badges"].append((badge, border_color))
+        if timer is not None:
+            timer.lap("decode")
+        plan = compile_layout(layout, self.font_dir)
+        if split:
+            # base and its overlay are kept apart, for dynamic overlay
+            (variant,) = variants
+            return plan.draw_parts(dict(values, **variant), timer), complete
+        layers = tuple(
+            plan.draw(dict(values, **variant), timer=timer) for variant in variants
+        )
+        return layers, complete
@@ -0,0 +1,50 @@
+from collections import namedtuple
+
+import discord
+
+# roles are ids, badges are badge name -> badge, as stored in db.badges
+Rewards = namedtuple("Rewards", "add_roles remove_roles badges")
+
+
+def build_rewards(server, roles_doc, links_doc, badges_doc):
+    """Level -> Rewards of server, from its db.roles, db.badgelinks and
+    db.badges documents (any may be None).
+
+    Roles are linked by name, they are looked up once here, links to roles
+    and badges that don't exist are left out."""
+    index = {}
+
+    def rewards(level):
+        return index.setdefault(int(level), Rewards(set(), set(), {}))
+
+    if roles_doc is not None:
+        for role_name, link in roles_doc["roles"].items():
+            level_rewards = rewards(link["level"])
+            add_role = discord.utils.get(server.roles, name=role_name)
+            if add_role is not None:
+                level_rewards.add_roles.add(add_role.id)
+            remove_role = discord.utils.get(server.roles, name=link["remove_role"])
+            if remove_role is not None:
+                level_rewards.remove_roles.add(remove_role.id)
+    if links_doc is not None and badges_doc is not None:
+        for badge_name, level in links_doc["badges"].items():
+            if badge_name in badges_doc["badges"]:
+                rewards(level).badges[badge_name] = badges_doc["badges"][badge_name]
+    return {
+        level: Rewards(frozenset(add), frozenset(remove), badges)
+        for level, (add, remove, badges) in index.items()
+    }
+
+
+def roles_after(member, *rewards):
+    """Roles member should have after getting `rewards` in order, None if
+    unchanged."""
+    current = {role.id for role in member.roles[1:]}  # without @everyone
+    new = current
+    for level_rewards in rewards:
+        # role that is both added and removed by links of one level is kept
+        new = (new - level_rewards.remove_roles) | level_rewards.add_roles
+    if new == current:
+        return None
+    # roles deleted after index was built are skipped
+    return [role for role in map(member.guild.get_role, new) if role is not None]
@@ -0,0 +1,136 @@
+import asyncio
+import itertools
+import logging
+from collections import deque
+
+log = logging.getLogger("red.fixator10-cogs.leveler")
+
+
+class _Job:
+    __slots__ = ("key", "factory", "deadline", "future", "queued_at", "started")
+
+    def __init__(self, key, factory, deadline, future, queued_at):
+        self.key = key
+        self.factory = factory
+        self.deadline = deadline
+        self.future = future
+        self.queued_at = queued_at
+        self.started = False
+
+
+class RenderScheduler:
+    """Runs card renders on a fixed number of workers.
+
+    Commands (PRIORITY_COMMAND) are rendered before level-up cards
+    (PRIORITY_LEVELUP). Requests with a key that is already queued or
+    rendering wait for that render instead of starting a new one.
+    Jobs with a deadline that were not started in time are dropped,
+    their callers get None."""
+
+    PRIORITY_COMMAND = 0
+    PRIORITY_LEVELUP = 1
+
+    def __init__(self, loop, workers: int = 2, samples: int = 1000):
+        self.loop = loop
+        self._queue = asyncio.PriorityQueue()
+        self._jobs = {}
+        self._order = itertools.count()
+        self._workers = [loop.create_task(self._worker()) for _ in range(workers)]
+        self.rendering = 0
+        self.submitted = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+        self.wait_times = deque(maxlen=samples)
+
+    @property
+    def depth(self):
+        return sum(not job.started for job in self._jobs.values())
+
+    @property
+    def idle(self):
+        """Whether new job would be started right away."""
+        return self.depth == 0 and self.rendering < len(self._workers)
+
+    async def render(self, key, factory, priority=PRIORITY_COMMAND, timeout=None):
+        """Render card with `factory` (coroutine function without arguments).
+
+        `timeout` is how long job may wait in queue before it's dropped."""
+        now = self.loop.time()
+        deadline = now + timeout if timeout is not None else None
+        job = self._jobs.get(key)
+        if job is not None:
+            self.coalesced += 1
+            if not job.started:
+                # keep the job alive for the most patient caller
+                if job.deadline is not None:
+                    job.deadline = (
+                        None if deadline is None else max(job.deadline, deadline)
+                    )
+                # queue it again with higher priority, worker skips the stale entry
+                self._queue.put_nowait((priority, next(self._order), job))
+        else:
+            self.submitted += 1
+            job = _Job(key, factory, deadline, self.loop.create_future(), now)
+            self._jobs[key] = job
+            self._queue.put_nowait((priority, next(self._order), job))
+        # one caller giving up shouldn't cancel render for the others
+        return await asyncio.shield(job.future)
+
+    async def _worker(self):
+        while True:
+            _priority, _order, job = await self._queue.get()
+            if job.started:
+                continue
+            job.started = True
+            now = self.loop.time()
+            self.wait_times.append(now - job.queued_at)
+            if job.deadline is not None and now > job.deadline:
+                self.dropped += 1
+                self._jobs.pop(job.key, None)
+                job.future.set_result(None)
+                continue
+            self.rendering += 1
+            try:
+                result = await job.factory()
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                log.exception(f"Unable to render {job.key}")
+                job.future.set_exception(e)
+                # exception is re-raised to callers, don't warn if none is left
+                job.future.exception()
+            else:
+                job.future.set_result(result)
+            finally:
+                self.rendering -= 1
+                self._jobs.pop(job.key, None)
+
+    def stats(self):
+        waits = sorted(self.wait_times)
+        if waits:
+            p50 = waits[len(waits) // 2]
+            p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))]
+            wait = (
+                f"{p50 * 1000:.0f} ms p50, {p95 * 1000:.0f} ms p95, "
+                f"{waits[-1] * 1000:.0f} ms max"
+            )
+        else:
+            wait = "no samples"
+        return (
+            f"Workers: {len(self._workers)}, rendering {self.rendering}\n"
+            f"Queue depth: {self.depth}\n"
+            f"Submitted: {self.submitted}, coalesced {self.coalesced}, "
+            f"dropped {self.dropped}, failed {self.failed}\n"
+            f"Queue wait: {wait}"
+        )
+
+    def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        # running jobs are cancelled by their workers
+        for job in self._jobs.values():
+            if not job.started:
+                job.future.cancel()
@@ -0,0 +1,118 @@
+import logging
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+log = logging.getLogger("red.fixator10-cogs.leveler")
+
+STAGES = (
+    "db",
+    "rank",
+    "cache",
+    "fetch",
+    "decode",
+    "compose",
+    "text",
+    "encode",
+    "ipc",
+    "upload",
+    "total",
+)
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # upper bounds, ms
+
+
+class StageTimer:
+    """Times stages of a single render.
+
+    `lap(stage)` adds time passed since previous lap to `stage`, so a stage
+    may be split over several parts of renderer."""
+
+    def __init__(self, timings, card):
+        self.timings = timings
+        self.card = card
+        self.stages = defaultdict(float)
+        self.started = self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] += now - self._last
+        self._last = now
+
+    def merge(self, stages, rest):
+        """Add stages timed elsewhere (e.g. in render daemon).
+
+        Time since previous lap that they don't cover is added to `rest`."""
+        now = time.perf_counter()
+        for stage, seconds in stages.items():
+            self.stages[stage] += seconds
+        self.stages[rest] += max(0.0, now - self._last - sum(stages.values()))
+        self._last = now
+
+    def finish(self):
+        total = time.perf_counter() - self.started
+        for stage, seconds in self.stages.items():
+            self.timings.add(self.card, stage, seconds)
+        self.timings.add(self.card, "total", total)
+        if log.isEnabledFor(logging.DEBUG):
+            stages = ", ".join(
+                f"{stage} {seconds * 1000:.1f}"
+                for stage, seconds in self.stages.items()
+            )
+            log.debug(f"{self.card} card rendered in {total * 1000:.1f} ms ({stages})")
+
+
+class RenderTimings:
+    """Rolling samples of render stage durations, per card type."""
+
+    def __init__(self, samples: int = 500):
+        self._samples = defaultdict(lambda: deque(maxlen=samples))
+
+    def start(self, card):
+        return StageTimer(self, card)
+
+    def add(self, card, stage, seconds):
+        self._samples[card, stage].append(seconds * 1000)
+
+    @contextmanager
+    def time(self, card, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(card, stage, time.perf_counter() - start)
+
+    def _rows(self, card=None):
+        cards = sorted({c for c, _ in self._samples} if card is None else {card})
+        for c in cards:
+            for stage in STAGES:
+                samples = self._samples.get((c, stage))
+                if samples:
+                    yield c, stage, sorted(samples)
+
+    def summary(self, card=None):
+        """Percentiles of every stage, in ms."""
+        lines = [
+            f"{'card':<8} {'stage':<8} {'count':>5} {'p50':>7} {'p95':>7} "
+            f"{'p99':>7} {'max':>7}"
+        ]
+        for c, stage, samples in self._rows(card):
+            p50, p95, p99 = (
+                samples[min(len(samples) - 1, int(len(samples) * q))]
+                for q in (0.5, 0.95, 0.99)
+            )
+            lines.append(
+                f"{c:<8} {stage:<8} {len(samples):>5} {p50:>7.1f} {p95:>7.1f} "
+                f"{p99:>7.1f} {samples[-1]:>7.1f}"
+            )
+        return "\n".join(lines)
+
+    def histogram(self, card):
+        """Number of samples of every stage of `card` per duration bucket."""
+        labels = [f"<{bound}" for bound in BUCKETS] + [f">{BUCKETS[-1]}"]
+        lines = [f"{'ms':<8}" + "".join(f"{label:>6}" for label in labels)]
+        for _card, stage, samples in self._rows(card):
+            counts = [0] * (len(BUCKETS) + 1)
+            for sample in samples:
+                counts[next((i for i, b in enumerate(BUCKETS) if sample < b), -1)] += 1
+            lines.append(f"{stage:<8}" + "".join(f"{count:>6}" for count in counts))
+        return "\n".join(lines)
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from collections import deque
+
+log = logging.getLogger("red.fixator10-cogs.leveler")
+
+
+class CardWarmer:
+    """Renders cards in advance, so commands find them in card cache.
+
+    Cards are only warmed while render workers are idle, at most `budget`
+    per minute. They are queued with the lowest priority and dropped if
+    they are not started within `timeout` seconds, so any command or level-up
+    card is rendered before them. A command for a card that is being warmed
+    waits for that render instead of starting another one."""
+
+    PRIORITY = 2  # after RenderScheduler.PRIORITY_LEVELUP
+
+    def __init__(self, scheduler, budget: int = 30, timeout: float = 5):
+        self.scheduler = scheduler
+        self.budget = budget
+        self.timeout = timeout
+        self._started = deque()
+        self._tasks = {}
+        self.warmed = 0
+        self.skipped_busy = 0
+        self.skipped_budget = 0
+        self.dropped = 0
+
+    def warm(self, key, factory):
+        """Render card with `factory` in background, if there is time for it."""
+        if key in self._tasks:
+            return
+        if not self.scheduler.idle:
+            self.skipped_busy += 1
+            return
+        now = self.scheduler.loop.time()
+        while self._started and now - self._started[0] > 60:
+            self._started.popleft()
+        if len(self._started) >= self.budget:
+            self.skipped_budget += 1
+            return
+        self._started.append(now)
+        self._tasks[key] = self.scheduler.loop.create_task(self._warm(key, factory))
+
+    async def _warm(self, key, factory):
+        try:
+            result = await self.scheduler.render(
+                key, factory, priority=self.PRIORITY, timeout=self.timeout
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # already logged by scheduler, command will try again
+            pass
+        else:
+            if result is None:
+                self.dropped += 1
+            else:
+                self.warmed += 1
+        finally:
+            self._tasks.pop(key, None)
+
+    def stats(self):
+        return (
+            f"Warmed: {self.warmed}, dropped {self.dropped}, "
+            f"pending {len(self._tasks)}\n"
+            f"Skipped: {self.skipped_busy} while busy, "
+            f"{self.skipped_budget} over budget of {self.budget}/min"
+        )
+
+    def close(self):
+        for task in self._tasks.values():
+            task.cancel()